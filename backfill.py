@@ -0,0 +1,210 @@
+'''backfill.py
+Массовая загрузка заметок за диапазон дат или за все ранее не загруженные
+даты. Заметки разбираются параллельно в пуле процессов, а результаты по мере
+готовности передаются одному писателю (БД или csv таблицы register)
+'''
+import datetime as dt
+import logging
+from obsidian import DailyNote
+from metrics import metrics
+
+
+def parse_daily_note(date:dt.date):
+    '''Рабочая функция пула: читает и разбирает заметку. Возвращает
+    (date, note, error, stats), чтобы одна битая заметка не останавливала
+    загрузку. stats - метрики разбора, если функция выполнялась в процессе
+    пула (в потоке метрики и так общие), их добавляет merge_stats'''
+    try:
+        note = DailyNote(date)
+        note.parsed
+        # текст заметки уже есть в parsed.sections, второй раз через pipe
+        # его передавать незачем; при необходимости он прочитается заново
+        note._note_content = None
+        result = date, note, None
+    except Exception as ex:
+        result = date, None, f'{type(ex).__name__}: {ex}'
+    # multiprocessing импортируется долго, загрузке одной заметки он не нужен
+    import multiprocessing
+    in_worker = multiprocessing.parent_process() is not None
+    return (*result, metrics.drain() if in_worker else None)
+
+
+def init_worker():
+    # процесс пула начинает с пустых метрик: унаследованные при fork метрики
+    # основного процесса не должны вернуться в него еще раз
+    metrics.reset()
+
+
+def merge_stats(result) -> tuple:
+    # (date, note, error, stats) -> (date, note, error), метрики процесса
+    # пула добавляются к метрикам этого процесса
+    *result, stats = result
+    metrics.merge(stats)
+    return tuple(result)
+
+
+def date_range(date_from:dt.date, date_to:dt.date) -> list:
+    # даты из хранилища в диапазоне [date_from, date_to]
+    return [
+        d for d in DailyNote.get_daily_notes_list()
+        if date_from <= d <= date_to
+    ]
+
+
+def iter_parsed_notes(dates, workers:int=None, chunksize:int=16):
+    '''Разбирает заметки в пуле процессов и отдает результаты в порядке дат'''
+    # пул процессов импортируется долго, загрузке одной заметки он не нужен
+    from concurrent.futures import ProcessPoolExecutor
+    dates = list(dates)
+    if not dates:
+        return
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=init_worker
+    ) as executor:
+        for result in executor.map(
+            parse_daily_note, dates, chunksize=chunksize
+        ):
+            yield merge_stats(result)
+
+
+class DataBaseWriter:
+    '''Пишет заметки в БД пачками по batch_size: одна транзакция и по одному
+    запросу на таблицу для всей пачки. upsert=True - перезагрузка уже
+    загруженных дат с записью только изменившихся строк. Если пачка не
+    сохранилась, ее заметки сохраняются по одной, чтобы битая заметка
+    пропускалась, а не отменяла остальные'''
+    def __init__(self, db, batch_size:int=100, upsert:bool=False):
+        self.db = db
+        self.upsert = upsert
+        self.batch_size = batch_size
+        self.batch = []
+        self.loaded = 0  # заметок сохранено в БД
+        self.failed_dates = []  # даты заметок, которые сохранить не удалось
+
+    def missing_dates(self) -> list:
+        not_loaded = {
+            row[0] if isinstance(row[0], dt.date) else
+            dt.date.fromisoformat(str(row[0]))
+            for row in self.db.scan_day_statistics()
+        }
+        return [d for d in DailyNote.get_daily_notes_list() if d in not_loaded]
+
+    def write(self, note):
+        self.batch.append(note)
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        batch, self.batch = self.batch, []
+        if not batch:
+            return
+        try:
+            self.db.dump_daily_notes(batch, self.upsert)
+            self.loaded += len(batch)
+            return
+        except Exception:
+            if len(batch) == 1:
+                self.failed_dates.append(batch[0].date)
+                return
+        # одна битая заметка откатывает всю пачку, поэтому пачка
+        # загружается заново по одной заметке на транзакцию
+        logging.warning(
+            f'Пачка заметок за {batch[0].date.isoformat()} - '
+            f'{batch[-1].date.isoformat()} не сохранена, загружаем по одной'
+        )
+        for note in batch:
+            try:
+                self.db.dump_daily_note(note, self.upsert)
+                self.loaded += 1
+            except Exception:
+                self.failed_dates.append(note.date)
+
+    # сохраняет все, что записано к этому моменту
+    def commit(self):
+        self.flush()
+
+    def close(self):
+        self.commit()
+
+
+class RegisterWriter:
+    '''Пишет заметки в таблицы register пачками по batch_size и обновляет
+    итоги по этим дням в DatesRep, сохраняет таблицы один раз в конце.
+    Отчет по сну пересчитывается целиком при сохранении'''
+    def __init__(self, batch_size:int=500):
+        import register
+        import representaion
+        self.tasks = register.TaskStatistics()
+        self.habits = register.HabitsStatistics()
+        self.sleep = register.SleepStatistics()
+        self.days = representaion.DatesRep()
+        self.sleep_rep = representaion.SleepRep()
+        self.batch_size = batch_size
+        self.batch = []
+        self.loaded = 0
+        self.failed_dates = []
+        self.unsaved = 0  # заметки в таблицах, которые еще не сохранены
+
+    def missing_dates(self) -> list:
+        loaded = set(self.tasks.dates_loaded.dt.date) \
+            | set(self.habits.dates_loaded.dt.date)
+        return [d for d in DailyNote.get_daily_notes_list() if d not in loaded]
+
+    def write(self, note):
+        self.batch.append(note)
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        batch, self.batch = self.batch, []
+        try:
+            self.tasks.load_notes(batch)
+            self.habits.load_notes(batch)
+            self.sleep.load_notes(batch)
+            self.days.refresh(self.tasks, self.habits, [n.date for n in batch])
+        except Exception:
+            self.failed_dates += [n.date for n in batch]
+            raise
+        self.unsaved += len(batch)
+
+    def commit(self):
+        self.flush()
+        self.tasks.push_to_csv()
+        self.habits.push_to_csv()
+        self.sleep.push_to_csv()
+        self.days.push_to_csv()
+        self.sleep_rep.calc_data(self.sleep.data)
+        self.sleep_rep.push_to_csv()
+        self.loaded += self.unsaved
+        self.unsaved = 0
+
+    def close(self):
+        self.commit()
+
+
+def backfill(writer, dates=None, workers:int=None) -> tuple:
+    '''Загружает заметки за dates (по умолчанию - все незагруженные даты)
+    через writer. Возвращает количество загруженных и пропущенных заметок.
+    Загруженными считаются заметки, которые writer действительно сохранил'''
+    dates = list(writer.missing_dates() if dates is None else dates)
+    try:
+        for date, note, error in iter_parsed_notes(dates, workers):
+            if error is not None:
+                logging.error(f'Заметку за {date.isoformat()} разобрать не'
+                              f' удалось: {error}')
+                continue
+            try:
+                writer.write(note)
+            except Exception as ex:
+                logging.error(f'Заметку за {date.isoformat()} загрузить не'
+                              f' удалось: {ex}')
+    finally:
+        try:
+            writer.close()
+        except Exception as ex:
+            logging.error(f'Заметки сохранить не удалось: {ex}')
+    loaded = writer.loaded
+    failed = len(dates) - loaded
+    logging.info(f'Массовая загрузка завершена: загружено {loaded},'
+                 f' с ошибками {failed}')
+    return loaded, failed
@@ -0,0 +1,370 @@
+'''bench.py
+Замеры скорости горячих участков на синтетических данных. Результаты
+печатаются в json, чтобы их можно было сравнивать между версиями.
+Хранилище заметок и папка data генерируются во временной папке:
+    python bench.py --days 3650 --habits 30 --tasks 10 --shape mixed
+Проверка времени запуска консольной команды (код возврата 1, если бюджет
+превышен), ее можно ставить в cron рядом с загрузкой:
+    python bench.py --check-startup 150
+Та же проверка выполняется тестом tests/test_startup.py
+'''
+import os
+import re
+import sys
+import csv
+import json
+import time
+import subprocess
+import random
+import argparse
+import tempfile
+import datetime as dt
+import yaml
+import obsidian as o
+
+
+def legacy_tasks(lines, default_reward=1) -> list:
+    # разбор задач в том виде, в каком он был до TASK_LINE, для сравнения
+    tasks = []
+    for line in lines:
+        task_pattern = re.compile(r"- \[( |x)\] ([A-zА-я0-9\s]+)")
+        reward_pattern = re.compile(r".*\((\d+)\)")
+        match = task_pattern.match(line.strip())
+        if match:
+            reward = reward_pattern.match(line)
+            tasks.append(o.Task(
+                match.group(1) != " ",
+                match.group(2).strip(),
+                int(reward.group(1)) if reward else default_reward,
+                None
+            ))
+    return tasks
+
+
+def synthetic_task_lines(count:int, seed:int=0) -> list:
+    rnd = random.Random(seed)
+    words = ('Стирка', 'Уборка в комнате', 'Ёлка', 'KMyMoney', 'Барабаны',
+             'Приготовить поесть', 'Сходить к врачу', 'Read book')
+    lines = []
+    for _ in range(count):
+        line = f'- [{rnd.choice(" x")}] {rnd.choice(words)}'
+        if rnd.random() < 0.7:
+            line += f' ({rnd.randint(1, 5)})'
+            if rnd.random() < 0.3:
+                line += ' комментарий к задаче'
+        lines.append(line)
+    return lines
+
+
+def timed(func, *args, repeat:int=3) -> float:
+    # лучшее время из repeat запусков
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def bench_task_parser(lines_count:int=200_000) -> dict:
+    lines = synthetic_task_lines(lines_count)
+    legacy = timed(legacy_tasks, lines)
+    current = timed(o._parse_tasks, lines, 1)
+    return {
+        'lines': lines_count,
+        'legacy_lines_per_sec': round(lines_count / legacy),
+        'current_lines_per_sec': round(lines_count / current),
+        'speedup': round(legacy / current, 2),
+    }
+
+
+def synthetic_frontmatter(habits:int=30, seed:int=0) -> str:
+    rnd = random.Random(seed)
+    lines = ['Day begin: 2025-08-01T07:30', 'Day end: 2025-08-01T23:40']
+    for i in range(habits):
+        value = rnd.choice((rnd.randint(0, 120), rnd.random() < 0.5, 'текст'))
+        lines.append(f'habit {i}: {str(value).lower()}')
+    return '\n'.join(lines)
+
+
+def bench_frontmatter(notes:int=2000, habits:int=30) -> dict:
+    texts = [synthetic_frontmatter(habits, seed) for seed in range(notes)]
+    pure = timed(lambda: [yaml.load(t, Loader=yaml.SafeLoader) for t in texts])
+    libyaml = timed(lambda: [yaml.load(t, Loader=o.yaml_loader()) for t in texts])
+    current = timed(lambda: [o.parse_frontmatter(t) for t in texts])
+    return {
+        'notes': notes,
+        'habits_per_note': habits,
+        'safe_loader_notes_per_sec': round(notes / pure),
+        'libyaml_notes_per_sec': round(notes / libyaml),
+        'current_notes_per_sec': round(notes / current),
+    }
+
+
+# формы frontmatter: flat - простые значения, которые разбирает быстрый
+# путь; quoted - строки в кавычках и комментарии; nested - списки, которые
+# уходят в yaml; mixed - все три вперемешку
+FRONTMATTER_SHAPES = ('flat', 'quoted', 'nested', 'mixed')
+HABIT_KINDS = ('float', 'bool', 'time')
+
+
+def habit_name(i:int) -> str:
+    return f'Привычка {i}'
+
+
+def synthetic_habit_value(kind:str, rnd, quoted:bool) -> str:
+    if kind == 'bool':
+        value = rnd.choice(('true', 'false'))
+    elif kind == 'time':
+        value = f'{rnd.randint(5, 9):02d}:{rnd.randint(0, 59):02d}'
+        # без кавычек yaml читает 07:30 как число в шестидесятеричной записи
+        return f"'{value}'"
+    else:
+        value = str(rnd.randint(0, 120))
+    return f'"{value}"' if quoted and kind != 'bool' else value
+
+
+def synthetic_note(date:dt.date, habits:int, tasks:int, shape:str,
+                   rnd) -> str:
+    if shape == 'mixed':
+        shape = rnd.choice(FRONTMATTER_SHAPES[:-1])
+    lines = ['---',
+             f'Day begin: {date.isoformat()}T0{rnd.randint(6, 9)}:30',
+             f'Day end: {date.isoformat()}T23:{rnd.randint(10, 59)}']
+    if shape == 'nested':
+        lines += ['tags:', '  - daily', '  - generated', 'aliases: [день]']
+    for i in range(habits):
+        value = synthetic_habit_value(
+            HABIT_KINDS[i % len(HABIT_KINDS)], rnd, shape == 'quoted'
+        )
+        comment = '  # заметка' if shape == 'quoted' and i % 5 == 0 else ''
+        lines.append(f'{habit_name(i)}: {value}{comment}')
+    lines += ['---', '# Заметки', 'Текст заметки', '', '# Tasks']
+    lines += synthetic_task_lines(tasks, seed=rnd.random())
+    lines += ['', '# Итоги', 'Конец дня']
+    return '\n'.join(lines) + '\n'
+
+
+def write_rules(data_dir:str, habits:int, start:dt.date):
+    # правило на каждую привычку, у половины привычек вторая версия правила
+    # с середины истории
+    path = os.path.join(data_dir, 'habits_rules.csv')
+    columns = ('name', 'reward', 'is_negative', 'target', 'type',
+               'valid_from', 'unit')
+    # TimeHabit хранит цель в минутах от начала дня: 07:30 -> 450
+    targets = {'float': '30', 'bool': 'True', 'time': str(7 * 60 + 30)}
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f, delimiter=';')
+        writer.writerow(('', *columns))
+        row_id = 0
+        for i in range(habits):
+            kind = HABIT_KINDS[i % len(HABIT_KINDS)]
+            versions = [start] if i % 2 else [start, start.replace(
+                year=start.year + 1)]
+            for reward, valid_from in enumerate(versions, 1):
+                writer.writerow((
+                    row_id, habit_name(i), reward, i % 7 == 0, targets[kind],
+                    kind, valid_from.isoformat(), 'мин' if kind != 'bool'
+                    else ''
+                ))
+                row_id += 1
+
+
+def make_vault(root:str, days:int, habits:int, tasks:int, shape:str='flat',
+               start:dt.date=dt.date(2016, 1, 1), seed:int=0) -> list:
+    '''Создает в root папки vault (заметки за days дней) и data (правила
+    привычек). Возвращает список дат заметок'''
+    if shape not in FRONTMATTER_SHAPES:
+        raise ValueError(f'Unknown frontmatter shape {shape}')
+    rnd = random.Random(seed)
+    vault = os.path.join(root, 'vault')
+    data_dir = os.path.join(root, 'data')
+    os.makedirs(vault, exist_ok=True)
+    os.makedirs(data_dir, exist_ok=True)
+    dates = [start + dt.timedelta(days=i) for i in range(days)]
+    for date in dates:
+        with open(os.path.join(vault, date.isoformat() + '.md'), 'w',
+                  encoding='utf-8') as f:
+            f.write(synthetic_note(date, habits, tasks, shape, rnd))
+    write_rules(data_dir, habits, start)
+    return dates
+
+
+def rate(count:int, seconds:float) -> int:
+    return round(count / seconds) if seconds else None
+
+
+def bench_parsing(dates) -> dict:
+    def parse_all():
+        for date in dates:
+            o.DailyNote(date).parsed
+    o.DailyNote.use_cache = False
+    no_cache = timed(parse_all)
+    o.DailyNote.use_cache = True
+    cache_fill = timed(parse_all, repeat=1)
+    cache_hit = timed(parse_all)
+    return {
+        'notes': len(dates),
+        'no_cache_notes_per_sec': rate(len(dates), no_cache),
+        'cache_fill_notes_per_sec': rate(len(dates), cache_fill),
+        'cache_hit_notes_per_sec': rate(len(dates), cache_hit),
+    }
+
+
+def bench_register(dates, single_notes:int=100) -> dict:
+    import register
+    notes = [o.DailyNote(d) for d in dates]
+    for note in notes:
+        note.parsed
+    results = {}
+    for table_class in (register.TaskStatistics, register.HabitsStatistics):
+        table = table_class()
+        load_notes = timed(table.load_notes, notes, repeat=1)
+        rows = len(table.data)
+        save = timed(table.push, repeat=1)
+        load = timed(table_class)
+        table = table_class()
+        sample = notes[-single_notes:]
+        load_note = timed(
+            lambda: [table.load_note(note=n) for n in sample], repeat=1
+        )
+        results[table_class.filename] = {
+            'rows': rows,
+            'load_notes_rows_per_sec': rate(rows, load_notes),
+            'load_note_notes_per_sec': rate(len(sample), load_note),
+            'save_sec': round(save, 4),
+            'load_sec': round(load, 4),
+        }
+    return results
+
+
+def bench_rules(dates) -> dict:
+    import dictionaries
+    def actual_rules():
+        # новый объект на каждый замер, чтобы кэш срезов был пустой
+        rules = dictionaries.RegisterRules()
+        for date in dates:
+            rules.get_actual_rules(date)
+    def cached_rules():
+        for date in sample:
+            rules.get_actual_rules(date)
+    rules = dictionaries.RegisterRules()
+    sample = dates[-rules.snapshots_cache_size:]
+    cached_rules()
+    return {
+        'rules': len(rules.data),
+        'dates': len(dates),
+        'cold_dates_per_sec': rate(len(dates), timed(actual_rules)),
+        'cached_dates_per_sec': rate(len(sample), timed(cached_rules)),
+    }
+
+
+def bench_habits_rep() -> dict:
+    import register
+    import dictionaries
+    import representaion
+    habits = register.HabitsStatistics().data
+    rules = dictionaries.RegisterRules().data
+    evaluate = timed(representaion.HabitsRep.evaluate, habits, rules)
+    return {
+        'rows': len(habits),
+        'evaluate_rows_per_sec': rate(len(habits), evaluate),
+    }
+
+
+def bench_vault(days:int=3650, habits:int=30, tasks:int=10,
+                shape:str='mixed') -> dict:
+    '''Полный набор замеров на синтетическом хранилище. Работает во
+    временной папке: data в config задана относительным путем'''
+    cwd = os.getcwd()
+    vault_path = o.DailyNote.vault_path
+    use_cache = o.DailyNote.use_cache
+    with tempfile.TemporaryDirectory() as root:
+        dates = make_vault(root, days, habits, tasks, shape)
+        try:
+            os.chdir(root)
+            o.DailyNote.vault_path = os.path.join(root, 'vault')
+            return {
+                'days': days,
+                'habits_per_day': habits,
+                'tasks_per_day': tasks,
+                'frontmatter_shape': shape,
+                'parsing': bench_parsing(dates),
+                'register': bench_register(dates),
+                'rules': bench_rules(dates),
+                'habits_rep': bench_habits_rep(),
+            }
+        finally:
+            os.chdir(cwd)
+            o.DailyNote.vault_path = vault_path
+            o.DailyNote.use_cache = use_cache
+
+
+# модули, которых не должно быть при запуске main.py до выполнения команды
+HEAVY_MODULES = ('pandas', 'numpy', 'yaml', 'psycopg2')
+# бюджет в мс на запуск main.py сверх запуска пустого интерпретатора
+STARTUP_BUDGET_MS = 150
+STARTUP_CODE = '''
+import sys, main
+main.build_parser().parse_args(['load', '2025-01-01'])
+import obsidian, backfill, watch, manifest, metrics
+print(','.join(m for m in sys.argv[1:] if m in sys.modules))
+'''
+
+
+def run_python(code:str, *args) -> tuple:
+    start = time.perf_counter()
+    out = subprocess.run(
+        [sys.executable, '-c', code, *args], capture_output=True, text=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)), check=True
+    ).stdout
+    return time.perf_counter() - start, out.strip()
+
+
+def check_startup(budget_ms:float=STARTUP_BUDGET_MS, repeat:int=5) -> dict:
+    '''Время запуска main.py с разбором аргументов и импортом модулей
+    загрузки одной заметки, за вычетом запуска интерпретатора. Проверяет
+    бюджет и то, что тяжелые модули не импортируются заранее'''
+    interpreter = min(run_python('pass')[0] for _ in range(repeat))
+    runs = [run_python(STARTUP_CODE, *HEAVY_MODULES) for _ in range(repeat)]
+    startup = min(t for t, _ in runs)
+    heavy = [m for m in runs[0][1].split(',') if m]
+    overhead_ms = (startup - interpreter) * 1000
+    return {
+        'interpreter_ms': round(interpreter * 1000, 1),
+        'startup_ms': round(startup * 1000, 1),
+        'overhead_ms': round(overhead_ms, 1),
+        'budget_ms': budget_ms,
+        'heavy_modules': heavy,
+        'ok': overhead_ms <= budget_ms and not heavy,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Замеры скорости')
+    parser.add_argument('--days', type=int, default=3650)
+    parser.add_argument('--habits', type=int, default=30)
+    parser.add_argument('--tasks', type=int, default=10)
+    parser.add_argument('--shape', choices=FRONTMATTER_SHAPES,
+                        default='mixed')
+    parser.add_argument('--out', help='файл для результатов вместо stdout')
+    parser.add_argument(
+        '--check-startup', type=float, nargs='?', const=STARTUP_BUDGET_MS,
+        metavar='BUDGET_MS', help='только проверить время запуска main.py'
+    )
+    args = parser.parse_args()
+    if args.check_startup is not None:
+        result = check_startup(args.check_startup)
+        print(json.dumps(result, indent=2, ensure_ascii=False))
+        sys.exit(0 if result['ok'] else 1)
+    results = json.dumps({
+        'task_parser': bench_task_parser(),
+        'frontmatter': bench_frontmatter(),
+        'vault': bench_vault(args.days, args.habits, args.tasks, args.shape),
+    }, indent=2, ensure_ascii=False)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            f.write(results + '\n')
+    else:
+        print(results)
@@ -14,6 +14,24 @@ DB_CONFIG = { # данные для подключения к БД
     "port": 5432,
     "dbname": "myStatistics",
     "user": "postgres",  # замени при необходимости
-    "password": "1"  # замени на свой пароль
+    "password": "1",  # замени на свой пароль
+    "pool_size": 4  # максимум соединений в пуле на процесс
 }
-DATA_DIR = os.path.join('data')
\ No newline at end of file
+DATA_DIR = os.path.join('data')
+# формат таблиц register: 'csv' или 'parquet' (нужен pyarrow)
+REGISTER_STORAGE = 'csv'
+# кэш разобранных заметок: папка и предельный размер в байтах
+NOTE_CACHE = True
+NOTE_CACHE_DIR = os.path.join(DATA_DIR, 'note_cache')
+NOTE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+# метрики запуска: 'jsonl' - дописывать строки json, 'prometheus' - текстовый
+# файл для node_exporter
+METRICS_FORMAT = 'jsonl'
+METRICS_PATH = os.path.join(LOG_DIR, 'metrics.jsonl')
+# размер журнала таблицы register в байтах, после которого он переносится в
+# снимок
+JOURNAL_COMPACT_BYTES = 4 * 1024 * 1024
+# БД для загрузки заметок: 'postgres' (DB_CONFIG) или 'sqlite' - локальный
+# файл без сервера
+DB_BACKEND = 'postgres'
+SQLITE_PATH = os.path.join(DATA_DIR, 'statistics.sqlite3')
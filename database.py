@@ -1,50 +1,102 @@
 '''
-Модуль для работы с базой данных
+Модуль для работы с базой данных. BaseDataBase - общая логика загрузки
+заметок (пачки, upsert, проверки), запросы к конкретной БД - в наследниках:
+DataBase для postgres и SQLiteDataBase для локального файла sqlite.
+open_database() выбирает БД по DB_BACKEND из config
 '''
 import os
-import yaml
+import json
 import datetime as dt
-import re
-from config import VAULT_PATH, LOG_DIR, CURRENT_LOG_NAME, LOG_PATH
+from config import DB_BACKEND, DB_CONFIG, SQLITE_PATH
 import logging
+import threading
+from abc import ABC, abstractmethod
+from collections import Counter
+from contextlib import contextmanager
+from metrics import stage, timed
+
+
+# пулы соединений процесса, общие для всех DataBase с одинаковыми параметрами
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(host, port, dbname, user, password, pool_size=1):
+    # psycopg2 нужен только для postgres
+    from psycopg2.pool import ThreadedConnectionPool
+    key = (host, port, dbname, user)
+    with _pools_lock:
+        if key not in _pools:
+            try:
+                _pools[key] = ThreadedConnectionPool(
+                    1, pool_size,
+                    host=host,
+                    port=port,
+                    dbname=dbname,
+                    password=password,
+                    user=user
+                )
+                logging.info('Успешное соединение с БД')
+            except Exception as ex:
+                logging.error(f'Ошибка соединения с БД: {ex}')
+                raise
+        return _pools[key]
+
+
+def execute_values(cursor, sql, rows, page_size=100):
+    from psycopg2.extras import execute_values
+    return execute_values(cursor, sql, rows, page_size=page_size)
+
+
+class IncompleteLoadError(Exception):
+    def __init__(self, message):
+        super().__init__(message)
 
-class DataBase:
-    '''Класс для соединения и работой с БД'''
-    def __init__(self, host, port, dbname, user, password):
-        self.user = user
-        self.host = host
-        self.port = port
-        self.dbname = dbname
-        self.password = password
-        self.cursor = self.connect().cursor()
 
-    # устанавливает соединение с БД по переданным параметрам
+class BaseDataBase(ABC):
+    '''Загрузка заметок в БД. Наследник определяет соединение (connect,
+    close) и запросы: scan_day_statistics, known_habits, insert_*_rows,
+    stored_*, update_day_statistics_rows, delete_habit_keys и
+    delete_task_keys.
+    Строки передаются в виде кортежей python, как их собирают habit_rows и
+    task_rows. Методы абстрактные, так что наследник, в котором какого-то
+    запроса нет, не создается'''
+    connection = None
+    cursor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    @abstractmethod
     def connect(self):
+        raise NotImplementedError
+
+    @abstractmethod
+    def close(self):
+        raise NotImplementedError
+
+    @contextmanager
+    def transaction(self):
+        '''Коммитит изменения при успешном выходе из блока и откатывает
+        их при исключении'''
+        connection = self.connect()
         try:
-            self.connection = psycopg2.connect(
-                host=self.host,
-                port=self.port,
-                dbname=self.dbname,
-                password=self.password,
-                user=self.user
-            )
-            logging.info('Успешное соединение с БД')
-            return self.connection
-        except Exception as ex:
-            logging.error(f'Ошибка соединения с БД: {ex}')
+            yield self.cursor
+            connection.commit()
+        except Exception:
+            connection.rollback()
             raise
 
     # Возвращает даты, которых нет в daysstatistics
+    @abstractmethod
     def scan_day_statistics(self):
-        self.cursor.execute('''
-select * from dates_not_in_statistics
-        ''')
-        return self.cursor.fetchall()
+        raise NotImplementedError
 
-    
-
-    # вставляет указанную дату в daysstatistics
-    def insert_day_statistics(self, date, day_begin, day_end):
+    @staticmethod
+    def validate_day_bounds(date, day_begin, day_end):
         if not isinstance(day_begin, dt.datetime) \
             or not(isinstance(day_end, dt.datetime)):
             logging.error(
@@ -54,12 +106,16 @@ select * from dates_not_in_statistics
                 'Не введена дата начала дня или дата конца дня'\
                 ', или неправильный формат даты'
                 )
+
+    # вставляет строки (date, day_begin, day_end) в daysstatistics
+    @abstractmethod
+    def insert_day_statistics_rows(self, rows):
+        raise NotImplementedError
+
+    # вставляет указанную дату в daysstatistics
+    def insert_day_statistics(self, date, day_begin, day_end):
         try:
-            self.cursor.execute("""
-                INSERT INTO daysstatistics (date, day_b, day_e)
-                VALUES (%s, %s, %s)
-            """, (date, day_begin, day_end)
-            )
+            self.insert_day_statistics_rows([(date, day_begin, day_end)])
             logging.info(
                 f'В daysstatistics загружена информация: {date.isoformat()}'
                 f' подъем был {day_begin.isoformat()}, сон {day_end.isoformat()}')
@@ -69,70 +125,498 @@ select * from dates_not_in_statistics
                  f' концу дня за {date.isoformat()}'
             )
             raise
-        
+
+    @staticmethod
+    def habit_rows(date, habits_list):
+        return [
+            (date, h.value_int, h.name) for h in habits_list
+            if h.name not in ('Day begin', 'Day end')
+        ]
+
+    @staticmethod
+    def task_rows(date, tasks_list):
+        return [
+            (t.name, date, t.reward, t.is_done, t.comment) for t in tasks_list
+        ]
+
+    # имена привычек из справочника habits
+    @abstractmethod
+    def known_habits(self) -> set:
+        raise NotImplementedError
+
+    def known_habit_rows(self, rows):
+        '''Оставляет строки привычек, которые есть в справочнике habits.
+        Остальные ключи frontmatter (tags, aliases и т.п.) пропускаются с
+        предупреждением и не отменяют загрузку'''
+        known = self.known_habits()
+        skipped = sorted({r[2] for r in rows if r[2] not in known})
+        if skipped:
+            logging.warning(
+                'Ключи frontmatter, которых нет в habits, пропущены: '
+                + ', '.join(skipped)
+            )
+        return [r for r in rows if r[2] in known]
+
+    # Вставляет строки (date, value, name) в dailyhabits, id привычки
+    # берется из habits по имени
+    @abstractmethod
+    def insert_habit_rows(self, rows):
+        raise NotImplementedError
+
+    # Вставляет строки (name, date, reward, is_done, info) в purposes
+    @abstractmethod
+    def insert_task_rows(self, rows):
+        raise NotImplementedError
+
     # Вставляет ежедневные привычки
     def insert_daily_habits(self, date, habits_list):
-        cnt_inserted = 0
-        cnt_input = 0
-        for h in habits_list:
-            try:
-                if h.name in ('Day begin', 'Day end'):
-                    continue
-                cnt_input += 1
-                self.cursor.execute('''
-                    insert into dailyhabits(day, habit_id, value)
-                    select %s, 
-                        h.id,
-                        %s
-                    from habits as h
-                    where h.name = %s
-                ''', (date, h.value_int, h.name)
-                )
-                cnt_inserted += 1
-            except Exception as ex:
-                logging.error(f'Привычку {h.name} загрузить не удалось: {ex}')
-                raise
-        return cnt_input, cnt_inserted
-    
+        rows = self.habit_rows(date, habits_list)
+        return len(rows), self.insert_habit_rows(rows)
+
     def insert_task(self, date, tasks_list):
-        cnt_inserted = 0
-        cnt_input = len(tasks_list)
-        for t in tasks_list:
-            self.cursor.execute('''
-                insert into purposes(name, day, reward, is_done, info)
-                values (%s, %s, %s, %s, %s)
-            ''', (t.name, date, t.reward, t.is_done, t.comment)
-            )
-            cnt_inserted += 1
-        return cnt_input, cnt_inserted
-        
-    def dump_daily_note(self, day):
-        connect = self.connect()
+        rows = self.task_rows(date, tasks_list)
+        return len(rows), self.insert_task_rows(rows)
+
+    # Сохраненные в БД данные за даты, нужны для сравнения при upsert
+    @abstractmethod
+    def stored_day_statistics(self, dates):
+        raise NotImplementedError
+
+    @abstractmethod
+    def stored_habit_rows(self, dates):
+        raise NotImplementedError
+
+    @abstractmethod
+    def stored_task_rows(self, dates):
+        raise NotImplementedError
+
+    # меняет day_b, day_e у уже загруженных дат
+    @abstractmethod
+    def update_day_statistics_rows(self, rows):
+        raise NotImplementedError
+
+    # удаляют строки по ключам (день, имя)
+    @abstractmethod
+    def delete_habit_keys(self, keys):
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_task_keys(self, keys):
+        raise NotImplementedError
+
+    @staticmethod
+    def changed_keys(stored_rows, new_rows, key):
+        # ключи строк, которые есть только в одном из наборов
+        stored, new = Counter(stored_rows), Counter(new_rows)
+        return {key(r) for r in (stored - new) + (new - stored)}
+
+    def upsert_day_statistics_rows(self, rows):
+        stored = self.stored_day_statistics(r[0] for r in rows)
+        for row in rows:
+            self.validate_day_bounds(*row)
+        new_rows = [r for r in rows if r[0] not in stored]
+        changed_rows = [
+            r for r in rows if r[0] in stored and tuple(stored[r[0]]) != r
+        ]
+        if changed_rows:
+            self.update_day_statistics_rows(changed_rows)
+        return self.insert_day_statistics_rows(new_rows) + len(changed_rows)
+
+    def upsert_habit_rows(self, dates, rows):
+        '''Перезаписывает только те привычки (дата, имя), значение которых
+        отличается от сохраненного. Возвращает (нужно записать, записано)'''
+        keys = self.changed_keys(
+            self.stored_habit_rows(dates), rows, lambda r: (r[0], r[2])
+        )
+        if not keys:
+            return 0, 0
+        self.delete_habit_keys(list(keys))
+        changed = [r for r in rows if (r[0], r[2]) in keys]
+        return len(changed), self.insert_habit_rows(changed)
+
+    def upsert_task_rows(self, dates, rows):
+        '''То же для задач, ключ - (дата, название)'''
+        keys = self.changed_keys(
+            self.stored_task_rows(dates), rows, lambda r: (r[1], r[0])
+        )
+        if not keys:
+            return 0, 0
+        self.delete_task_keys(list(keys))
+        changed = [r for r in rows if (r[1], r[0]) in keys]
+        return len(changed), self.insert_task_rows(changed)
+
+    def dump_daily_note(self, day, upsert=False):
+        self.dump_daily_notes([day], upsert)
+
+    def dump_daily_notes(self, days, upsert=False):
+        '''Загружает несколько заметок одной транзакцией: по одному запросу
+        на каждую таблицу для всей пачки. С upsert=True уже загруженные даты
+        сравниваются с БД и перезаписываются только изменившиеся строки'''
+        days = list(days)
+        if not days:
+            return
+        period = days[0].date.isoformat() if len(days) == 1 else \
+            f'{days[0].date.isoformat()} - {days[-1].date.isoformat()}'
         try:
-            self.insert_day_statistics(day.date, day.day_begin, day.day_end)
-            habit_cnt_all, habit_cnt_loaded = self.insert_daily_habits(
-                day.date, day.habits_list
-                )
-            task_cnt_all, task_cnt_loaded = self.insert_task(
-                day.date, day.tasks_list
-                )
-            if task_cnt_all == task_cnt_loaded \
-                and habit_cnt_all == habit_cnt_loaded:
-                connect.commit()
-                logging.info(
-                    f'Транзакция завершена, все данные загружены'
+            with stage('db_dump', rows=len(days)), self.transaction():
+                day_rows = [(d.date, d.day_begin, d.day_end) for d in days]
+                habit_rows = self.known_habit_rows([
+                    r for d in days
+                    for r in self.habit_rows(d.date, d.habits_list)
+                ])
+                task_rows = [
+                    r for d in days
+                    for r in self.task_rows(d.date, d.tasks_list)
+                ]
+                if upsert:
+                    dates = [d.date for d in days]
+                    self.upsert_day_statistics_rows(day_rows)
+                    habit_cnt_all, habit_cnt_loaded = \
+                        self.upsert_habit_rows(dates, habit_rows)
+                    task_cnt_all, task_cnt_loaded = \
+                        self.upsert_task_rows(dates, task_rows)
+                else:
+                    self.insert_day_statistics_rows(day_rows)
+                    habit_cnt_all = len(habit_rows)
+                    habit_cnt_loaded = self.insert_habit_rows(habit_rows)
+                    task_cnt_all = len(task_rows)
+                    task_cnt_loaded = self.insert_task_rows(task_rows)
+                if task_cnt_loaded != task_cnt_all \
+                    or habit_cnt_loaded != habit_cnt_all:
+                    raise IncompleteLoadError(
+                        'Не удалось загрузить все данные, транзакция отменена.'
+                        f' Загружено {task_cnt_loaded} из {task_cnt_all} '
+                        f'задач и {habit_cnt_loaded} из {habit_cnt_all} '
+                        'привычек.'
                     )
-            else:
-                logging.error(
-                    'Не удалось загрузить все данные, транзакция отменена. '\
-                    'До отмены транзакции удалось загрузить '\
-                    f'{task_cnt_loaded} из {task_cnt_all} задач и '\
-                    f'{habit_cnt_loaded} из {habit_cnt_all} привычек.'
-                )
-                connect.rollback()
-            logging.info(f'Заметки за {day.date.isoformat()} сохранены')
+            logging.info(f'Заметки за {period} ({len(days)} шт.) сохранены')
         except Exception as ex:
-            logging.error(
-                f'Заметки за {day.date.isoformat()} не были сохранены: {ex}'
-                )
+            logging.error(f'Заметки за {period} не были сохранены: {ex}')
+            raise
+
+
+class DataBase(BaseDataBase):
+    '''Класс для соединения и работой с БД postgres. Соединение берется из
+    пула один раз и используется для всех заметок, пока не вызван close()'''
+    def __init__(self, host, port, dbname, user, password, pool_size=1):
+        self.user = user
+        self.host = host
+        self.port = port
+        self.dbname = dbname
+        self.password = password
+        self.pool = get_pool(host, port, dbname, user, password, pool_size)
+        self.connection = None
+        self.connect()
+
+    # берет соединение из пула, если его еще нет
+    def connect(self):
+        if self.connection is None or self.connection.closed:
+            self.connection = self.pool.getconn()
+            self.cursor = self.connection.cursor()
+        return self.connection
+
+    # возвращает соединение в пул
+    def close(self):
+        if self.connection is not None:
+            self.cursor.close()
+            self.pool.putconn(self.connection)
+            self.connection = None
+
+    @timed('db_scan')
+    def scan_day_statistics(self):
+        self.cursor.execute('''
+select * from dates_not_in_statistics
+        ''')
+        return self.cursor.fetchall()
+
+    def insert_day_statistics_rows(self, rows):
+        for row in rows:
+            self.validate_day_bounds(*row)
+        if not rows:
+            return 0
+        execute_values(self.cursor, """
+            INSERT INTO daysstatistics (date, day_b, day_e)
+            VALUES %s
+        """, rows, page_size=len(rows)
+        )
+        return self.cursor.rowcount
+
+    def known_habits(self) -> set:
+        self.cursor.execute('select name from habits')
+        return {r[0] for r in self.cursor.fetchall()}
+
+    # id привычки подставляется через join с habits, одним запросом
+    def insert_habit_rows(self, rows):
+        if not rows:
+            return 0
+        try:
+            execute_values(self.cursor, '''
+                insert into dailyhabits(day, habit_id, value)
+                select v.day, h.id, v.value
+                from (values %s) as v(day, value, name)
+                join habits as h on h.name = v.name
+            ''', rows, page_size=len(rows)
+            )
+        except Exception as ex:
+            logging.error(f'Привычки загрузить не удалось: {ex}')
+            raise
+        return self.cursor.rowcount
+
+    def insert_task_rows(self, rows):
+        if not rows:
+            return 0
+        execute_values(self.cursor, '''
+            insert into purposes(name, day, reward, is_done, info)
+            values %s
+        ''', rows, page_size=len(rows)
+        )
+        return self.cursor.rowcount
+
+    def stored_day_statistics(self, dates):
+        self.cursor.execute('''
+            select date, day_b, day_e from daysstatistics
+            where date = any(%s)
+        ''', (list(dates),))
+        return {r[0]: r for r in self.cursor.fetchall()}
+
+    def stored_habit_rows(self, dates):
+        self.cursor.execute('''
+            select d.day, d.value, h.name
+            from dailyhabits as d
+            join habits as h on h.id = d.habit_id
+            where d.day = any(%s)
+        ''', (list(dates),))
+        return self.cursor.fetchall()
+
+    def stored_task_rows(self, dates):
+        self.cursor.execute('''
+            select name, day, reward, is_done, info from purposes
+            where day = any(%s)
+        ''', (list(dates),))
+        return self.cursor.fetchall()
+
+    def update_day_statistics_rows(self, rows):
+        execute_values(self.cursor, '''
+            update daysstatistics as d
+            set day_b = v.day_b, day_e = v.day_e
+            from (values %s) as v(date, day_b, day_e)
+            where d.date = v.date
+        ''', rows, page_size=len(rows)
+        )
+
+    def delete_habit_keys(self, keys):
+        execute_values(self.cursor, '''
+            delete from dailyhabits as d
+            using (values %s) as v(day, name), habits as h
+            where d.day = v.day and h.name = v.name and d.habit_id = h.id
+        ''', keys, page_size=len(keys)
+        )
+
+    def delete_task_keys(self, keys):
+        execute_values(self.cursor, '''
+            delete from purposes as p
+            using (values %s) as v(day, name)
+            where p.day = v.day and p.name = v.name
+        ''', keys, page_size=len(keys)
+        )
+
+
+SQLITE_SCHEMA = '''
+create table if not exists daysstatistics (
+    date text primary key,
+    day_b text not null,
+    day_e text not null
+);
+create table if not exists habits (
+    id integer primary key,
+    name text not null unique
+);
+create table if not exists dailyhabits (
+    day text not null,
+    habit_id integer not null references habits(id),
+    value integer
+);
+create index if not exists dailyhabits_day on dailyhabits(day);
+create table if not exists purposes (
+    name text not null,
+    day text not null,
+    reward integer,
+    is_done integer not null,
+    info text
+);
+create index if not exists purposes_day on purposes(day);
+-- календарные дни с 2000 года по сегодня, которых нет в daysstatistics
+create view if not exists dates_not_in_statistics as
+with recursive days(date) as (
+    select '2000-01-01'
+    union all
+    select date(date, '+1 day') from days where date < date('now', 'localtime')
+)
+select date from days
+where date not in (select date from daysstatistics);
+'''
+
+
+class SQLiteDataBase(BaseDataBase):
+    '''Та же БД в локальном файле sqlite: для работы без сервера и замеров
+    записи без сети. Журнал WAL, каждая пачка заметок - одна транзакция с
+    executemany на таблицу. Даты хранятся строками в iso формате.
+    auto_habits=True добавляет в habits привычки, которых там еще нет (в
+    postgres справочник habits ведется отдельно): ключи frontmatter, у
+    которых есть значение привычки'''
+    def __init__(self, path=SQLITE_PATH, auto_habits=True):
+        self.path = path
+        self.auto_habits = auto_habits
+        self.connection = None
+        self.connect()
+
+    def connect(self):
+        if self.connection is None:
+            import sqlite3
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            # pipeline пишет из своего потока записи; все записи идут через
+            # один поток, поэтому соединение можно отдать другому потоку
+            self.connection = sqlite3.connect(
+                self.path, check_same_thread=False
+            )
+            self.connection.execute('pragma journal_mode=wal')
+            self.connection.execute('pragma synchronous=normal')
+            self.connection.execute('pragma foreign_keys=on')
+            self.connection.executescript(SQLITE_SCHEMA)
+            self.cursor = self.connection.cursor()
+        return self.connection
+
+    def close(self):
+        if self.connection is not None:
+            self.cursor.close()
+            self.connection.close()
+            self.connection = None
+
+    @staticmethod
+    def iso(value):
+        return None if value is None else value.isoformat()
+
+    @staticmethod
+    def iso_list(dates) -> str:
+        # список дат одним параметром для json_each, без ограничения на
+        # число параметров запроса
+        return json.dumps([d.isoformat() for d in dates])
+
+    @timed('db_scan')
+    def scan_day_statistics(self):
+        self.cursor.execute('select date from dates_not_in_statistics')
+        return [(dt.date.fromisoformat(r[0]),) for r in self.cursor]
+
+    def insert_day_statistics_rows(self, rows):
+        for row in rows:
+            self.validate_day_bounds(*row)
+        if not rows:
+            return 0
+        self.cursor.executemany(
+            'insert into daysstatistics (date, day_b, day_e) values (?, ?, ?)',
+            [tuple(self.iso(v) for v in row) for row in rows]
+        )
+        return self.cursor.rowcount
+
+    def add_habits(self, names):
+        self.cursor.executemany(
+            'insert or ignore into habits (name) values (?)',
+            [(name,) for name in set(names)]
+        )
+
+    def known_habits(self) -> set:
+        self.cursor.execute('select name from habits')
+        return {r[0] for r in self.cursor}
+
+    def known_habit_rows(self, rows):
+        if self.auto_habits:
+            # привычкой считается ключ со значением да/нет, числом или
+            # временем, а не свойства obsidian вроде tags и aliases
+            self.add_habits(r[2] for r in rows if r[1] is not None)
+        return super().known_habit_rows(rows)
+
+    def insert_habit_rows(self, rows):
+        if not rows:
+            return 0
+        try:
+            self.cursor.executemany('''
+                insert into dailyhabits (day, habit_id, value)
+                select ?, id, ? from habits where name = ?
+            ''', [(day.isoformat(), value, name) for day, value, name in rows]
+            )
+        except Exception as ex:
+            logging.error(f'Привычки загрузить не удалось: {ex}')
             raise
+        return self.cursor.rowcount
+
+    def insert_task_rows(self, rows):
+        if not rows:
+            return 0
+        self.cursor.executemany('''
+            insert into purposes (name, day, reward, is_done, info)
+            values (?, ?, ?, ?, ?)
+        ''', [(name, day.isoformat(), reward, is_done, info)
+              for name, day, reward, is_done, info in rows]
+        )
+        return self.cursor.rowcount
+
+    # при чтении строки приводятся к тем же типам, что у новых строк, чтобы
+    # upsert мог их сравнить
+    def stored_day_statistics(self, dates):
+        self.cursor.execute('''
+            select date, day_b, day_e from daysstatistics
+            where date in (select value from json_each(?))
+        ''', (self.iso_list(dates),))
+        stored = {}
+        for date, day_b, day_e in self.cursor:
+            date = dt.date.fromisoformat(date)
+            stored[date] = (date, dt.datetime.fromisoformat(day_b),
+                            dt.datetime.fromisoformat(day_e))
+        return stored
+
+    def stored_habit_rows(self, dates):
+        self.cursor.execute('''
+            select d.day, d.value, h.name
+            from dailyhabits as d
+            join habits as h on h.id = d.habit_id
+            where d.day in (select value from json_each(?))
+        ''', (self.iso_list(dates),))
+        return [(dt.date.fromisoformat(day), value, name)
+                for day, value, name in self.cursor]
+
+    def stored_task_rows(self, dates):
+        self.cursor.execute('''
+            select name, day, reward, is_done, info from purposes
+            where day in (select value from json_each(?))
+        ''', (self.iso_list(dates),))
+        return [(name, dt.date.fromisoformat(day), reward, bool(is_done), info)
+                for name, day, reward, is_done, info in self.cursor]
+
+    def update_day_statistics_rows(self, rows):
+        self.cursor.executemany(
+            'update daysstatistics set day_b = ?, day_e = ? where date = ?',
+            [(self.iso(b), self.iso(e), d.isoformat()) for d, b, e in rows]
+        )
+
+    def delete_habit_keys(self, keys):
+        self.cursor.executemany('''
+            delete from dailyhabits
+            where day = ? and habit_id = (select id from habits where name = ?)
+        ''', [(day.isoformat(), name) for day, name in keys]
+        )
+
+    def delete_task_keys(self, keys):
+        self.cursor.executemany(
+            'delete from purposes where day = ? and name = ?',
+            [(day.isoformat(), name) for day, name in keys]
+        )
+
+
+def open_database(backend=DB_BACKEND) -> BaseDataBase:
+    '''БД, выбранная в config: 'postgres' (DB_CONFIG) или 'sqlite'
+    (SQLITE_PATH)'''
+    if backend == 'sqlite':
+        return SQLiteDataBase(SQLITE_PATH)
+    if backend == 'postgres':
+        return DataBase(**DB_CONFIG)
+    raise ValueError(f'Unknown database backend {backend}')
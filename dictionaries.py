@@ -2,11 +2,16 @@
 
 import datetime as dt
 import os
+from functools import lru_cache
 from config import DATA_DIR
+import numpy as np
 import pandas as pd
 from register import BaseStatistics
+from storage import write_csv
 
 class Habit:
+    habit_type = pd.NA
+
     def __init__(
             self, 
             name:str, 
@@ -28,16 +33,21 @@ class Habit:
         self.target = target
         self.valid_from = self.validate_date(valid_from, dt.date.today())
         self.unit = unit
-        self.pd_row = pd.DataFrame({
+
+    @property
+    def pd_row(self) -> pd.DataFrame:
+        # строка для RegisterRules, собирается только когда нужна
+        pd_row = pd.DataFrame({
             'name': [self.name],
             'reward': [self.reward],
             'is_negative': [self.is_negative],
             'target': [self.target],
-            'type': [pd.Na],
+            'type': [self.habit_type],
             'valid_from': [self.valid_from],
             'unit': [self.unit],
         })
-        self.pd_row['unit'] = self.pd_row['unit'].astype('object')
+        pd_row['unit'] = pd_row['unit'].astype('object')
+        return pd_row
 
 
     @staticmethod
@@ -84,6 +94,8 @@ class Habit:
                     'timestamp int/float or str (isoformat)')
 
 class NumericHabit(Habit):
+    habit_type = 'float'
+
     def __init__(
             self, 
             name:str, 
@@ -96,7 +108,6 @@ class NumericHabit(Habit):
             raise TypeError('"target" argument must be a number')
         target = str(target)
         super().__init__(name, target, unit, reward, is_negative, valid_from)
-        self.pd_row['type'] = ['float']
 
     def __str__(self):
         return (
@@ -106,6 +117,8 @@ class NumericHabit(Habit):
         )
 
 class BooleanHabit(Habit):
+    habit_type = 'bool'
+
     def __init__(
         self,
         name:str,
@@ -119,7 +132,6 @@ class BooleanHabit(Habit):
             raise TypeError('"target" argument must be bool type')
         target = str(target)
         super().__init__(name, target, unit, reward, is_negative, valid_from)
-        self.pd_row['type'] = ['bool']
 
     def __str__(self):
         return (
@@ -130,6 +142,8 @@ class BooleanHabit(Habit):
 
 
 class TimeHabit(Habit):
+    habit_type = 'time'
+
     def __init__(
         self,
         name:str,
@@ -144,7 +158,6 @@ class TimeHabit(Habit):
         self.time_str = dt.time(target//60, target%60)
         target = str(target)
         super().__init__(name, target, unit, reward, is_negative, valid_from)
-        self.pd_row['type'] = 'time'
 
     def __str__(self):
         return (
@@ -176,6 +189,8 @@ class RegisterRules(BaseStatistics):
         'valid_from' : 'datetime64[ns]',
         'unit' : 'object'
     }
+    snapshots_cache_size = 256
+
     def __init__(self):
         self.path = os.path.join(DATA_DIR, self.filename)
         if not os.path.exists(self.path):
@@ -184,29 +199,144 @@ class RegisterRules(BaseStatistics):
         else:
             self.data = self.load_from_csv()
         self.data = self.data.astype(self.types_dict)
-        
+        self.invalidate()
+
+    def invalidate(self):
+        # сбрасывает индекс и кэш срезов, вызывается при изменении правил
+        self._index = None
+        self._snapshot = lru_cache(maxsize=self.snapshots_cache_size)(
+            self._build_snapshot
+        )
+
+    @property
+    def index(self) -> dict:
+        '''name -> (отсортированные valid_from, позиции строк в self.data).
+        Строится один раз после загрузки или изменения правил'''
+        if self._index is None:
+            valid_from = self.data['valid_from'].to_numpy('datetime64[ns]')
+            order = np.lexsort((valid_from, self.data['name'].to_numpy()))
+            self._index = {}
+            names = self.data['name'].to_numpy()[order]
+            for name in pd.unique(names):
+                positions = order[names == name]
+                self._index[name] = (valid_from[positions], positions)
+        return self._index
+
+    @staticmethod
+    def _position(bounds, positions, as_of):
+        # бинарный поиск последнего правила с valid_from <= as_of
+        i = np.searchsorted(bounds, as_of, side='right') - 1
+        return positions[i] if i >= 0 else None
+
+    def rule_for(self, name:str, as_of_date:dt.date=None):
+        '''Правило привычки name на дату или None, если его еще не было'''
+        as_of_date = Habit.validate_date(as_of_date, if_none=dt.date.today())
+        if name not in self.index:
+            return None
+        position = self._position(
+            *self.index[name], np.datetime64(as_of_date, 'ns')
+        )
+        return None if position is None else self.data.iloc[position]
+
+    def _build_snapshot(self, as_of_date:dt.date):
+        as_of = np.datetime64(as_of_date, 'ns')
+        positions = [
+            self._position(bounds, rows, as_of)
+            for bounds, rows in self.index.values()
+        ]
+        out = self.data.iloc[[p for p in positions if p is not None]].copy()
+        out['unit'] = out['unit'].fillna("")
+        return out
+
     def update(self, habit:Habit):
         # inserts new habit row into datafrane. Replaces old if valid_from and name already in it
         self.data = self.data[~(
             (self.data['name'] == habit.name)&
             (self.data['valid_from'] == habit.valid_from))]
         self.data = pd.concat((self.data, habit.pd_row), ignore_index=True)
+        self.invalidate()
 
     def get_actual_rules(self, as_of_date:dt.date=None):
         as_of_date = Habit.validate_date(as_of_date, if_none=dt.date.today())
-        indexes = self.data[self.data['valid_from'] <= pd.to_datetime(as_of_date)]\
-            .groupby('name')['valid_from']\
-            .idxmax()
-        out = self.data.loc[indexes]
-        out['unit'] = out['unit'].fillna("")
-        return out
+        # срез кэшируется, наружу отдается копия
+        return self._snapshot(as_of_date).copy()
 
     def push_to_csv(self):
-        self.data\
+        self.data = self.data\
             .sort_values(by='valid_from')\
-            .reset_index(drop=True)\
-            .to_csv(self.path, sep=';')
-        
+            .reset_index(drop=True)
+        write_csv(self.data, self.path)
+        self.invalidate()
+
+
+class SleepRewards(BaseStatistics):
+    '''Награды за сон. Строка - полоса значений показателя measure от lower
+    (включительно) до upper (не включительно), пустая граница - без
+    ограничения. measure: slept - минут сна, begin и end - минуты от полуночи
+    даты заметки до подъема и до отхода ко сну (после полуночи больше 1440).
+    Строки с одним valid_from - одна версия таблицы, она действует до
+    следующей версии целиком'''
+    filename = 'sleep_rewards.csv'
+    template = pd.DataFrame(
+        columns = [
+            'measure',
+            'lower',
+            'upper',
+            'reward',
+            'valid_from'
+        ]
+    )
+    types_dict = {
+        'measure' : 'object',
+        'lower' : 'float',
+        'upper' : 'float',
+        'reward' : 'Int16',
+        'valid_from' : 'datetime64[ns]'
+    }
+    measures = ('slept', 'begin', 'end')
+
+    def __init__(self):
+        self.path = os.path.join(DATA_DIR, self.filename)
+        if not os.path.exists(self.path):
+            self.template.to_csv(self.path, sep=';')
+            self.data = self.template.copy()
+        else:
+            self.data = self.load_from_csv()
+        self.data = self.data.astype(self.types_dict)
+
+    def add(self, measure:str, reward:int, lower:float=None,
+            upper:float=None, valid_from:dt.date=None):
+        if measure not in self.measures:
+            raise ValueError(f'measure must be one of {self.measures}')
+        if not isinstance(reward, int):
+            raise TypeError('"reward" argument must be int type')
+        row = pd.DataFrame({
+            'measure': [measure],
+            'lower': [lower],
+            'upper': [upper],
+            'reward': [reward],
+            'valid_from': [pd.Timestamp(
+                Habit.validate_date(valid_from, dt.date.today())
+            )],
+        }).astype(self.types_dict)
+        self.data = pd.concat((self.data, row), ignore_index=True)
+
+    def versions_for(self, dates) -> np.ndarray:
+        '''valid_from версии таблицы, действующей на каждую из dates
+        (NaT, если ни одной версии еще не было)'''
+        versions = np.unique(self.data['valid_from'].to_numpy('datetime64[ns]'))
+        dates = np.asarray(dates, dtype='datetime64[ns]')
+        i = np.searchsorted(versions, dates, side='right') - 1
+        out = np.full(len(dates), np.datetime64('NaT'), 'datetime64[ns]')
+        out[i >= 0] = versions[i[i >= 0]]
+        return out
+
+    def push_to_csv(self):
+        self.data = self.data\
+            .sort_values(by=['valid_from', 'measure', 'lower'])\
+            .reset_index(drop=True)
+        write_csv(self.data, self.path)
+
 if __name__ == '__main__':
     a = RegisterRules()
     print(a.get_actual_rules())
\ No newline at end of file
@@ -1,28 +1,38 @@
-# BUG: два раза устанавливается соединение
 # TODO все-таки пусть будут ежеденвные логи ссохранением логов за последние 7 дней
-# TODO: добавить отчистку логов
-# TODO: обновление информации, если таковая уже загружена
-# TODO: получение информации через консоль
-# TODO: массовая загрузка ранее не загруженных дат
-
-
-import datetime as dt
+'''main.py
+Запуск из консоли, cron или systemd:
+    python main.py load [ДАТА]           заметка за дату (по умолчанию вчера)
+    python main.py backfill FROM TO      заметки за диапазон дат
+    python main.py backfill              все незагруженные заметки
+    python main.py backfill --pipeline   то же, разбор и запись одновременно
+    python main.py missing               даты, которых еще нет в БД
+    python main.py report                пересчитать отчеты register
+    python main.py watch                 загружать заметки по мере сохранения
+По умолчанию данные пишутся в БД (postgres или sqlite, см. --db и
+DB_BACKEND в config), с --register - в таблицы register.
+pandas, yaml и psycopg2 импортируются только в командах, которым они нужны,
+чтобы загрузка одной заметки запускалась быстро (см. tests/test_startup.py
+и bench.py --check-startup)
+'''
+import os
 import re
+import sys
+import argparse
+import datetime as dt
 import logging
-import pandas as pd
+from config import LOG_DIR, LOG_PATH, DB_BACKEND
 
 
-# НАСТРОЙКИ
+def setup_logging():
+    os.makedirs(LOG_DIR, exist_ok=True)
+    logging.basicConfig(
+        filename=LOG_PATH,
+        level=logging.INFO,
+        format='%(levelname)s | %(asctime)s | %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S',
+        encoding='utf-8'
+    )
 
-# Настройки логирования
-os.makedirs(LOG_DIR, exist_ok=True)
-logging.basicConfig(
-    filename=LOG_PATH,
-    level=logging.INFO,
-    format='%(levelname)s | %(asctime)s | %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S',
-    encoding='utf-8'
-)
 
 # чистим логи, которые существуют более 3 месяцев
 def cleanup_old_logs(log_dir, max_months=3):
@@ -40,35 +50,156 @@ def cleanup_old_logs(log_dir, max_months=3):
                     logging.warning(f"Не удалось удалить лог {fname}: {e}")
 
 
-# Классы
-class FileFormatError(Exception):
-    def __init__(self, message):
-        super().__init__(message)
-        logging.ERROR(f'Ошибка формата файла')
+def parse_date(value:str) -> dt.date:
+    try:
+        return dt.date.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f'Некорректная дата {value}, нужен формат 2025-06-10'
+        )
+
+
+def open_writer(args, db=None, upsert=False):
+    import backfill
+    if args.register:
+        return backfill.RegisterWriter()
+    return backfill.DataBaseWriter(db, upsert=upsert)
+
+
+def database(args):
+    # соединение с БД нужно только, если пишем не в register
+    from contextlib import nullcontext
+    if args.register:
+        return nullcontext()
+    from database import open_database
+    return open_database(args.db)
+
+
+def cmd_load(args):
+    from obsidian import DailyNote
+    date = args.date or dt.date.today() - dt.timedelta(days=1)
+    note = DailyNote(date)
+    with database(args) as db:
+        if db is None:
+            writer = open_writer(args)
+            writer.write(note)
+            writer.close()
+        else:
+            # повторная загрузка даты перезаписывает только изменения
+            db.dump_daily_note(note, upsert=True)
+    print(f'Заметка за {date.isoformat()} загружена')
+
+
+def cmd_backfill(args):
+    import backfill
+    dates = None
+    if args.date_from or args.date_to:
+        if not (args.date_from and args.date_to):
+            raise SystemExit('Нужны обе даты диапазона: FROM TO')
+        dates = backfill.date_range(args.date_from, args.date_to)
+    with database(args) as db:
+        writer = open_writer(args, db, upsert=dates is not None)
+        if args.pipeline:
+            from pipeline import Pipeline
+            if dates is None:
+                dates = writer.missing_dates()
+            loaded, failed = Pipeline(writer, args.workers).run(dates)
+        else:
+            loaded, failed = backfill.backfill(writer, dates, args.workers)
+    print(f'Загружено заметок: {loaded}, с ошибками: {failed}')
+    return 1 if failed else 0
+
+
+def cmd_missing(args):
+    with database(args) as db:
+        for date in open_writer(args, db).missing_dates():
+            print(date.isoformat())
+
+
+def cmd_report(args):
+    import representaion
+    balance = representaion.stream_reports(args.date_from, args.date_to)
+    sleep = representaion.SleepRep()
+    sleep.calc_data()
+    sleep.push()
+    print(f'Отчеты пересчитаны, баланс: {balance}')
+
+
+def cmd_watch(args):
+    from watch import VaultWatcher
+    with database(args) as db:
+        VaultWatcher(
+            open_writer(args, db, upsert=True),
+            use_inotify=not args.poll
+        ).run()
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description='Загрузка дневных заметок obsidian'
+    )
+    parser.add_argument(
+        '--register', action='store_true',
+        help='писать в таблицы register вместо БД'
+    )
+    parser.add_argument(
+        '--db', choices=('postgres', 'sqlite'), default=DB_BACKEND,
+        help='БД для загрузки, по умолчанию DB_BACKEND из config'
+    )
+    parser.add_argument(
+        '--no-metrics', action='store_true',
+        help='не печатать и не сохранять метрики запуска'
+    )
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    load = commands.add_parser('load', help='загрузить заметку за дату')
+    load.add_argument('date', nargs='?', type=parse_date,
+                      help='дата, по умолчанию вчера')
+    load.set_defaults(func=cmd_load)
+
+    backfill = commands.add_parser(
+        'backfill', help='загрузить диапазон или все незагруженные заметки'
+    )
+    backfill.add_argument('date_from', nargs='?', type=parse_date)
+    backfill.add_argument('date_to', nargs='?', type=parse_date)
+    backfill.add_argument('--workers', type=int, default=None)
+    backfill.add_argument(
+        '--pipeline', action='store_true',
+        help='разбирать и записывать заметки одновременно (pipeline.py)'
+    )
+    backfill.set_defaults(func=cmd_backfill)
+
+    missing = commands.add_parser('missing', help='даты без загруженных данных')
+    missing.set_defaults(func=cmd_missing)
+
+    report = commands.add_parser('report', help='пересчитать отчеты')
+    report.add_argument('date_from', nargs='?', type=parse_date)
+    report.add_argument('date_to', nargs='?', type=parse_date)
+    report.set_defaults(func=cmd_report)
+
+    watch = commands.add_parser('watch', help='наблюдать за заметками')
+    watch.add_argument('--poll', action='store_true',
+                       help='опрашивать папку даже если есть inotify')
+    watch.set_defaults(func=cmd_watch)
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    setup_logging()
+    cleanup_old_logs(LOG_DIR)
+    from metrics import metrics
+    metrics.enabled = not args.no_metrics
+    try:
+        return args.func(args) or 0
+    except Exception as ex:
+        logging.error(f'Команда {args.command} завершилась с ошибкой: {ex}')
+        raise
+    finally:
+        if metrics.enabled and args.command != 'watch':
+            # сводка в stderr, чтобы не смешиваться с выводом команды
+            print(metrics.report(), file=sys.stderr)
 
 
-# === ОСНОВНАЯ ЛОГИКА ===
 if __name__ == '__main__':
-    input_date = input('Введите дату, которую хотите загрузить (если не'\
-        + 'ввести ничего, то загружена будет вчерашняя дата): ')
-    if input_date.strip() == '.':
-        connection = DataBase(**DB_CONFIG)
-        connection.connect()
-        date = DailyNote(dt.date.today())
-        print(date.get_daily_notes_list())
-        print(connection.scan_day_statistics)
-        quit()
-    if input_date.strip() == '':
-        DATE = dt.date.today() - dt.timedelta(days=1)
-    else:
-        try:
-            DATE = dt.date.fromisoformat(input_date) # надо определеить способ как выбрать дату
-        except ValueError:
-            logging.error(f'Введен некорректный формат даты {input_date}')
-            raise ValueError('Введите корректный формат даты, например 2025-06-10')
-        
-    d1 = DailyNote(DATE)
-
-    connection = DataBase(**DB_CONFIG)
-    connection.connect()
-    connection.dump_daily_note(d1)
\ No newline at end of file
+    sys.exit(main())
@@ -0,0 +1,162 @@
+'''manifest.py
+Манифест хранилища: для каждой заметки запоминает mtime, размер и хэш
+содержимого, чтобы при следующей загрузке обрабатывать только изменившиеся
+заметки, а не всё хранилище
+'''
+import os
+import csv
+import hashlib
+import datetime as dt
+import logging
+from typing import NamedTuple
+from config import VAULT_PATH, DATA_DIR
+
+
+class NoteState(NamedTuple):
+    mtime_ns: int
+    size: int
+    hash: str
+
+
+class VaultChanges(NamedTuple):
+    added: list
+    modified: list
+    deleted: list
+
+    def __bool__(self):
+        return bool(self.added or self.modified or self.deleted)
+
+
+def note_date(filename:str):
+    # дата заметки по имени файла или None, если это не дневная заметка
+    if not filename.endswith('.md'):
+        return None
+    try:
+        return dt.date.fromisoformat(filename[:-3])
+    except ValueError:
+        return None
+
+
+def file_hash(path:str) -> str:
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class VaultManifest:
+    '''Состояние заметок на момент последней загрузки. entries - последнее
+    увиденное состояние хранилища, confirmed - состояние успешно
+    загруженных заметок, только оно и сохраняется в файл'''
+    filename = 'manifest.csv'
+
+    def __init__(self, vault_path:str=VAULT_PATH, path:str=None):
+        self.vault_path = vault_path
+        self.path = path or os.path.join(DATA_DIR, self.filename)
+        self.entries = self.load()
+        self.confirmed = dict(self.entries)
+
+    def load(self) -> dict:
+        entries = {}
+        if not os.path.exists(self.path):
+            return entries
+        with open(self.path, 'r', encoding='utf-8', newline='') as f:
+            for row in csv.DictReader(f, delimiter=';'):
+                entries[dt.date.fromisoformat(row['date'])] = NoteState(
+                    int(row['mtime_ns']), int(row['size']), row['hash']
+                )
+        return entries
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f, delimiter=';')
+            writer.writerow(('date', 'mtime_ns', 'size', 'hash'))
+            for date in sorted(self.confirmed):
+                writer.writerow((date.isoformat(), *self.confirmed[date]))
+        os.replace(tmp_path, self.path)
+
+    def confirm(self, dates=None):
+        '''Отмечает заметки за dates (по умолчанию все) загруженными в их
+        текущем состоянии, удаленные заметки убираются'''
+        if dates is None:
+            self.confirmed = dict(self.entries)
+            return
+        for date in dates:
+            if date in self.entries:
+                self.confirmed[date] = self.entries[date]
+            else:
+                self.confirmed.pop(date, None)
+
+    def unconfirmed(self, dates) -> list:
+        # заметки, текущее состояние которых еще не загружено
+        return sorted(
+            d for d in set(dates)
+            if d in self.entries and self.entries[d] != self.confirmed.get(d)
+        )
+
+    @property
+    def dates(self) -> list:
+        return sorted(self.entries)
+
+    def scan(self) -> dict:
+        '''Текущее состояние хранилища за один проход os.scandir. Хэш
+        пересчитывается только для файлов, у которых поменялись mtime или
+        размер'''
+        state = {}
+        with os.scandir(self.vault_path) as it:
+            for entry in it:
+                date = note_date(entry.name)
+                if date is None or not entry.is_file():
+                    continue
+                state[date] = self.note_state(date, entry.path, entry.stat())
+        return state
+
+    def note_state(self, date, path, stat) -> NoteState:
+        old = self.entries.get(date)
+        if old is not None and old.mtime_ns == stat.st_mtime_ns \
+                and old.size == stat.st_size:
+            return old
+        return NoteState(stat.st_mtime_ns, stat.st_size, file_hash(path))
+
+    def refresh(self) -> VaultChanges:
+        '''Сканирует хранилище, обновляет манифест в памяти и возвращает
+        добавленные, измененные и удаленные даты. Загруженные изменения
+        отмечаются через confirm() и сохраняются через save()'''
+        state = self.scan()
+        added = sorted(d for d in state if d not in self.entries)
+        deleted = sorted(d for d in self.entries if d not in state)
+        modified = sorted(
+            d for d in state
+            if d in self.entries and state[d].hash != self.entries[d].hash
+        )
+        self.entries = state
+        changes = VaultChanges(added, modified, deleted)
+        if changes:
+            logging.info(
+                f'Манифест обновлен: добавлено {len(added)}, изменено '
+                f'{len(modified)}, удалено {len(deleted)} заметок'
+            )
+        return changes
+
+    def refresh_dates(self, dates) -> VaultChanges:
+        '''То же, что refresh(), но проверяет только заметки за dates, без
+        обхода всего хранилища'''
+        added, modified, deleted = [], [], []
+        for date in sorted(set(dates)):
+            path = os.path.join(self.vault_path, date.isoformat() + '.md')
+            old = self.entries.get(date)
+            try:
+                state = self.note_state(date, path, os.stat(path))
+            except FileNotFoundError:
+                if old is not None:
+                    deleted.append(date)
+                    del self.entries[date]
+                continue
+            if old is None:
+                added.append(date)
+            elif state.hash != old.hash:
+                modified.append(date)
+            self.entries[date] = state
+        return VaultChanges(added, modified, deleted)
@@ -0,0 +1,219 @@
+'''metrics.py
+Замеры времени по стадиям загрузки и счетчики. Стадия оборачивается в
+контекстный менеджер stage() или декоратор timed(), для каждой стадии
+копятся число вызовов, суммарное и максимальное время и число строк.
+Стадии могут быть вложены (разбор заметки внутри добавления в register),
+время вложенной стадии входит и во время внешней.
+В конце запуска report() пишет метрики в файл (json lines или текстовый
+формат prometheus) и возвращает сводку для лога и консоли.
+Метрики собираются в своем процессе: процесс пула отдает накопленное через
+drain() вместе с результатом, а основной процесс добавляет это к своим
+метрикам через merge()
+'''
+import os
+import json
+import time
+import logging
+import datetime as dt
+from functools import wraps
+from contextlib import contextmanager
+from config import METRICS_PATH, METRICS_FORMAT
+
+
+class StageStats:
+    __slots__ = ('calls', 'seconds', 'max_seconds', 'rows')
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.rows = 0
+
+    def add(self, seconds:float, rows:int):
+        self.calls += 1
+        self.seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.rows += rows
+
+    def merge(self, calls:int, seconds:float, max_seconds:float, rows:int):
+        self.calls += calls
+        self.seconds += seconds
+        self.max_seconds = max(self.max_seconds, max_seconds)
+        self.rows += rows
+
+
+class StageTimer:
+    # то, что отдает stage(): число строк можно уточнить внутри блока
+    __slots__ = ('rows',)
+
+    def __init__(self, rows:int):
+        self.rows = rows
+
+
+class Metrics:
+    enabled = True
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.counters = {}
+
+    @contextmanager
+    def stage(self, name:str, rows:int=0):
+        '''with metrics.stage('db_dump', rows=len(days)) as s: ...
+        Время записывается и при исключении внутри блока'''
+        timer = StageTimer(rows)
+        if not self.enabled:
+            yield timer
+            return
+        start = time.perf_counter()
+        try:
+            yield timer
+        finally:
+            stats = self.stages.get(name)
+            if stats is None:
+                stats = self.stages[name] = StageStats()
+            stats.add(time.perf_counter() - start, timer.rows or 0)
+
+    def timed(self, name:str):
+        '''Декоратор: каждый вызов функции учитывается как стадия name'''
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.stage(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def count(self, name:str, value:int=1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def drain(self) -> dict:
+        '''Стадии и счетчики, накопленные с прошлого вызова, простым
+        словарем, который можно передать из процесса пула. Накопленное
+        обнуляется, чтобы не передать его дважды'''
+        data = {
+            'stages': {
+                name: (s.calls, s.seconds, s.max_seconds, s.rows)
+                for name, s in self.stages.items()
+            },
+            'counters': self.counters,
+        }
+        self.stages = {}
+        self.counters = {}
+        return data
+
+    def merge(self, data:dict):
+        # добавляет результат drain() другого процесса
+        if not data or not self.enabled:
+            return
+        for name, values in data['stages'].items():
+            stats = self.stages.get(name)
+            if stats is None:
+                stats = self.stages[name] = StageStats()
+            stats.merge(*values)
+        for name, value in data['counters'].items():
+            self.count(name, value)
+
+    def hit_rates(self) -> dict:
+        # для пар счетчиков <имя>_hit / <имя>_miss
+        rates = {}
+        for name in self.counters:
+            prefix, _, kind = name.rpartition('_')
+            if kind not in ('hit', 'miss') or prefix in rates:
+                continue
+            hits = self.counters.get(prefix + '_hit', 0)
+            total = hits + self.counters.get(prefix + '_miss', 0)
+            if total:
+                rates[prefix] = hits / total
+        return rates
+
+    def records(self) -> list:
+        run_at = dt.datetime.now().isoformat(timespec='seconds')
+        records = [
+            {'run_at': run_at, 'stage': name, 'calls': s.calls,
+             'seconds': round(s.seconds, 6),
+             'max_seconds': round(s.max_seconds, 6), 'rows': s.rows}
+            for name, s in self.stages.items()
+        ]
+        records += [
+            {'run_at': run_at, 'counter': name, 'value': value}
+            for name, value in self.counters.items()
+        ]
+        records += [
+            {'run_at': run_at, 'hit_rate': name, 'value': round(rate, 4)}
+            for name, rate in self.hit_rates().items()
+        ]
+        records.append({
+            'run_at': run_at, 'stage': 'total', 'calls': 1,
+            'seconds': round(time.perf_counter() - self.started, 6)
+        })
+        return records
+
+    def prometheus(self) -> str:
+        lines = []
+        for name, s in self.stages.items():
+            labels = f'{{stage="{name}"}}'
+            lines += [
+                f'obsidian_stage_calls_total{labels} {s.calls}',
+                f'obsidian_stage_seconds_total{labels} {s.seconds:.6f}',
+                f'obsidian_stage_max_seconds{labels} {s.max_seconds:.6f}',
+                f'obsidian_stage_rows_total{labels} {s.rows}',
+            ]
+        for name, value in self.counters.items():
+            lines.append(f'obsidian_counter_total{{name="{name}"}} {value}')
+        for name, rate in self.hit_rates().items():
+            lines.append(f'obsidian_hit_rate{{name="{name}"}} {rate:.4f}')
+        lines.append('obsidian_run_seconds '
+                     f'{time.perf_counter() - self.started:.6f}')
+        return '\n'.join(lines) + '\n'
+
+    def summary(self) -> str:
+        lines = [f'{"стадия":<32}{"вызовов":>9}{"сек":>10}{"макс сек":>10}'
+                 f'{"строк":>10}']
+        for name, s in sorted(self.stages.items(),
+                              key=lambda item: -item[1].seconds):
+            lines.append(f'{name:<32}{s.calls:>9}{s.seconds:>10.3f}'
+                         f'{s.max_seconds:>10.3f}{s.rows:>10}')
+        for name, rate in self.hit_rates().items():
+            lines.append(f'{name}: попаданий {rate:.1%}')
+        lines.append(
+            f'всего: {time.perf_counter() - self.started:.3f} сек'
+        )
+        return '\n'.join(lines)
+
+    def write(self, path:str=METRICS_PATH, format:str=METRICS_FORMAT):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        if format == 'prometheus':
+            # файл для node_exporter textfile collector, перезаписывается
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(self.prometheus())
+            os.replace(tmp_path, path)
+        elif format == 'jsonl':
+            with open(path, 'a', encoding='utf-8') as f:
+                for record in self.records():
+                    f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        else:
+            raise ValueError(f'Unknown metrics format {format}')
+
+    def report(self, path:str=METRICS_PATH, format:str=METRICS_FORMAT) -> str:
+        '''Записывает метрики запуска и возвращает сводку'''
+        summary = self.summary()
+        try:
+            self.write(path, format)
+        except OSError as ex:
+            logging.warning(f'Метрики записать не удалось: {ex}')
+        logging.info('Метрики запуска:\n' + summary)
+        return summary
+
+
+# метрики процесса
+metrics = Metrics()
+stage = metrics.stage
+timed = metrics.timed
+count = metrics.count
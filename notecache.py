@@ -0,0 +1,130 @@
+'''notecache.py
+Кэш разобранных заметок на диске. Запись хранит результат parse_note в
+pickle и действительна, пока у файла заметки те же mtime и размер, так что
+при холодном старте вместо чтения и разбора заметки нужен только stat.
+Размер кэша ограничен, при переполнении удаляются давно не читанные записи
+'''
+import os
+import pickle
+import hashlib
+import logging
+from config import NOTE_CACHE_DIR, NOTE_CACHE_MAX_BYTES
+from metrics import count
+
+# меняется при изменении формата записи или правил разбора заметки
+CACHE_VERSION = 1
+
+
+class NoteCache:
+    def __init__(self, path:str=NOTE_CACHE_DIR,
+                 max_bytes:int=NOTE_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(path, exist_ok=True)
+        self._total = None
+        self.hits = 0
+        self.misses = 0
+
+    def entry_path(self, note_path:str) -> str:
+        # одна запись на файл заметки, имя не зависит от текущей папки
+        key = hashlib.sha1(os.path.abspath(note_path).encode()).hexdigest()
+        return os.path.join(self.path, key[:20] + '.pickle')
+
+    def get(self, note_path:str, stat):
+        '''Кэшированный ParsedNote или None, если записи нет или заметка
+        с тех пор изменилась'''
+        from obsidian import ParsedNote, Task, Habit
+        entry_path = self.entry_path(note_path)
+        try:
+            with open(entry_path, 'rb') as f:
+                version, mtime_ns, size, frontmatter, sections, tasks, \
+                    habits = pickle.load(f)
+        except FileNotFoundError:
+            return self.miss()
+        except Exception as ex:
+            logging.warning(f'Запись кэша {entry_path} не прочитана: {ex}')
+            return self.miss()
+        if (version, mtime_ns, size) != \
+                (CACHE_VERSION, stat.st_mtime_ns, stat.st_size):
+            return self.miss()
+        # время доступа нужно для вытеснения давно не читанных записей
+        os.utime(entry_path)
+        self.hits += 1
+        count('note_cache_hit')
+        return ParsedNote(
+            frontmatter,
+            sections,
+            tuple(Task(*t) for t in tasks),
+            tuple(Habit(*h) for h in habits),
+        )
+
+    def miss(self):
+        self.misses += 1
+        count('note_cache_miss')
+        return None
+
+    def put(self, note_path:str, stat, parsed):
+        entry = (
+            CACHE_VERSION,
+            stat.st_mtime_ns,
+            stat.st_size,
+            parsed.frontmatter,
+            parsed.sections,
+            tuple((t.is_done, t.name, t.reward, t.comment)
+                  for t in parsed.tasks),
+            tuple((h.name, h.value) for h in parsed.habits),
+        )
+        entry_path = self.entry_path(note_path)
+        tmp_path = f'{entry_path}.{os.getpid()}.tmp'
+        try:
+            old_size = os.path.getsize(entry_path)
+        except OSError:
+            old_size = 0
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, entry_path)
+        self._total = self.total_bytes() - old_size \
+            + os.path.getsize(entry_path)
+        if self._total > self.max_bytes:
+            self.evict()
+
+    def total_bytes(self) -> int:
+        if self._total is None:
+            self._total = sum(
+                e.stat().st_size for e in os.scandir(self.path)
+                if e.name.endswith('.pickle')
+            )
+        return self._total
+
+    def evict(self):
+        # удаляет самые давно читанные записи, пока кэш не станет меньше
+        # 90% от лимита
+        entries = sorted(
+            (e.stat().st_mtime_ns, e.stat().st_size, e.path)
+            for e in os.scandir(self.path) if e.name.endswith('.pickle')
+        )
+        total = sum(size for _, size, _ in entries)
+        limit = self.max_bytes * 0.9
+        removed = 0
+        for _, size, path in entries:
+            if total <= limit:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+        self._total = total
+        logging.info(f'Из кэша заметок удалено записей: {removed}')
+
+
+_cache = None
+
+
+def get_note_cache() -> NoteCache:
+    # кэш процесса создается при первом обращении
+    global _cache
+    if _cache is None:
+        _cache = NoteCache()
+    return _cache
@@ -3,10 +3,13 @@
 этих данных
 '''
 import os
-import yaml
 import datetime as dt
 import re
-from config import VAULT_PATH, LOG_DIR, CURRENT_LOG_NAME, LOG_PATH
+from typing import NamedTuple
+from config import VAULT_PATH, LOG_DIR, CURRENT_LOG_NAME, LOG_PATH, NOTE_CACHE
+from manifest import note_date
+from metrics import stage
+from notecache import get_note_cache
 import logging
 
 
@@ -15,23 +18,275 @@ class FileFormatError(Exception):
         super().__init__(message)
 
 
+class ParsedNote(NamedTuple):
+    '''Результат однократного разбора заметки. Неизменяемый, поэтому его
+    можно кэшировать и передавать между потребителями'''
+    frontmatter: str
+    sections: tuple  # ((заголовок, текст), ...) в порядке следования
+    tasks: tuple
+    habits: tuple
+
+
+# Строка задачи: "- [x] Название (3) комментарий". Награда и комментарий
+# необязательны, комментарий бывает только после награды. Название - любой
+# текст, в том числе с "ё", знаками препинания и цифрами
+TASK_LINE = re.compile(
+    r'[-*+] \[([ xX])\] '
+    r'(?:(?P<named>.*?)\s*\((?P<reward>\d+)\)\s*(?P<comment>.*)|(?P<name>.*))'
+)
+HEADING = re.compile(r'#{1,6}(?:\s|$)')
+
+
+def _task_from_match(match, default_reward):
+    mark, named, reward, comment, name = match.groups()
+    if reward is None:
+        name = name.strip()
+        reward = default_reward
+        comment = None
+    else:
+        name = named
+        reward = int(reward)
+        comment = comment.strip() or None
+    if not name:
+        return None
+    return Task(mark != ' ', name, reward, comment)
+
+
+def parse_task_line(line:str, default_reward:int=1):
+    # Task для строки задачи или None, если это не задача
+    match = TASK_LINE.match(line.strip())
+    return None if match is None else _task_from_match(match, default_reward)
+
+
+def _parse_tasks(lines, default_reward) -> tuple:
+    match_line = TASK_LINE.match
+    tasks = []
+    for line in lines:
+        match = match_line(line.strip())
+        if match is not None:
+            task = _task_from_match(match, default_reward)
+            if task is not None:
+                tasks.append(task)
+    return tuple(tasks)
+
+
+def yaml_loader():
+    # yaml импортируется только когда frontmatter не разобрался быстрым
+    # путем. libyaml в разы быстрее, но он есть не во всех сборках pyyaml
+    import yaml
+    return getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+
+# привычки, значения которых приводятся к datetime
+DATETIME_HABITS = ('Day begin', 'Day end')
+
+_FLAT_LINE = re.compile(
+    r'([^\s#\'"\[\]{},&*!|>%@`?:-][^:#]*?):(?:[ \t]+(.*?))?[ \t]*'
+)
+_BOOLS = {
+    'true': True, 'True': True, 'TRUE': True,
+    'false': False, 'False': False, 'FALSE': False,
+    'yes': True, 'Yes': True, 'YES': True,
+    'no': False, 'No': False, 'NO': False,
+    'on': True, 'On': True, 'ON': True,
+    'off': False, 'Off': False, 'OFF': False,
+}
+_NULLS = ('', '~', 'null', 'Null', 'NULL')
+_INT = re.compile(r'[-+]?(?:0|[1-9][0-9]*)')
+# как в yaml 1.1: перед точкой со знаком нужна цифра, "-.5" - строка
+_FLOAT = re.compile(
+    r'(?:[-+]?[0-9]+\.[0-9]*|\.[0-9]+)(?:[eE][-+][0-9]+)?'
+)
+_DATE = re.compile(r'[0-9]{4}-[0-9]{2}-[0-9]{2}')
+# без секунд yaml дату со временем не распознает и оставляет строкой
+_DATETIME_NO_SECONDS = re.compile(
+    r'[0-9]{4}-[0-9]{2}-[0-9]{2}[Tt ][0-9]{2}:[0-9]{2}'
+)
+
+
+class _NotFlat(Exception):
+    pass
+
+
+def _flat_scalar(value):
+    # значение так же, как его прочитал бы SafeLoader, либо _NotFlat
+    if value is None or value in _NULLS:
+        return None
+    first = value[0]
+    if first in '\'"':
+        inner = value[1:-1]
+        if len(value) < 2 or value[-1] != first or first in inner \
+                or '\\' in inner:
+            raise _NotFlat
+        return inner
+    if first in '[]{}&*!|>%@`#,?=<' or ' #' in value or ': ' in value:
+        raise _NotFlat
+    if value in _BOOLS:
+        return _BOOLS[value]
+    if _INT.fullmatch(value):
+        return int(value)
+    if _FLOAT.fullmatch(value):
+        return float(value)
+    if _DATE.fullmatch(value):
+        return dt.date.fromisoformat(value)
+    if _DATETIME_NO_SECONDS.fullmatch(value):
+        return value
+    if first in '-+.0123456789':
+        # восьмеричные, 1_000, .inf, полные timestamp и т.п. - в yaml
+        raise _NotFlat
+    return value
+
+
+def _parse_flat_frontmatter(frontmatter:str) -> dict:
+    '''Быстрый разбор frontmatter из строк "ключ: значение", какой дает
+    шаблон дневной заметки. Все остальное отдается yaml через _NotFlat'''
+    result = {}
+    for line in frontmatter.splitlines():
+        if not line.strip() or line.startswith('#'):
+            continue
+        match = _FLAT_LINE.fullmatch(line)
+        if match is None:
+            raise _NotFlat
+        key = match.group(1).rstrip()
+        # yaml прочитал бы ключ "true", "1" или дату не строкой
+        if not isinstance(_flat_scalar(key), str):
+            raise _NotFlat
+        result[key] = _flat_scalar(match.group(2))
+    return result
+
+
+def _to_datetime(value):
+    if isinstance(value, dt.datetime):
+        return value
+    if isinstance(value, str):
+        try:
+            return dt.datetime.fromisoformat(value)
+        except ValueError:
+            return value
+    return value
+
+
+def _bound(date:dt.date, value):
+    # время подъема или отхода ко сну: datetime, "07:30" или число минут
+    # (так yaml читает 07:30 без кавычек) относительно даты заметки
+    if isinstance(value, dt.datetime):
+        return value
+    if isinstance(value, str):
+        try:
+            value = dt.time.fromisoformat(value.strip())
+        except ValueError:
+            return None
+        return dt.datetime.combine(date, value)
+    if isinstance(value, int) and not isinstance(value, bool) \
+            and 0 <= value < 48 * 60:
+        return dt.datetime.combine(date, dt.time()) \
+            + dt.timedelta(minutes=value)
+    return None
+
+
+def day_bounds(date:dt.date, begin, end) -> tuple:
+    '''(подъем, отход ко сну) по значениям "Day begin" и "Day end" заметки
+    за date, None вместо значения, которое не удалось прочитать. Отход ко
+    сну раньше подъема означает, что спать легли уже после полуночи'''
+    begin = _bound(date, begin)
+    end = _bound(date, end)
+    if begin is not None and end is not None and end < begin:
+        end += dt.timedelta(days=1)
+    return begin, end
+
+
+def parse_frontmatter(frontmatter:str) -> dict:
+    if not frontmatter:
+        return {}
+    try:
+        habits = _parse_flat_frontmatter(frontmatter)
+    except _NotFlat:
+        import yaml
+        try:
+            habits = yaml.load(frontmatter, Loader=yaml_loader())
+        except yaml.YAMLError as e:
+            logging.error(f"YAML wasn't read {e}")
+            raise
+    if not isinstance(habits, dict):
+        return {}
+    for key in DATETIME_HABITS:
+        if key in habits:
+            habits[key] = _to_datetime(habits[key])
+    return habits
+
+
+def _parse_habits(frontmatter) -> tuple:
+    return tuple(Habit(k, v) for k, v in parse_frontmatter(frontmatter).items())
+
+
+def parse_note(text:str, default_reward:int=1) -> ParsedNote:
+    '''Разбирает текст заметки за один проход по строкам: frontmatter между
+    первыми "---", затем секции по заголовкам. Задачи берутся из всего, что
+    идет после заголовка "# Tasks" до следующего заголовка'''
+    lines = text.splitlines()
+    frontmatter = ''
+    start = 0
+    if lines and lines[0].strip() == '---':
+        for i in range(1, len(lines)):
+            if lines[i].strip() == '---':
+                frontmatter = '\n'.join(lines[1:i])
+                start = i + 1
+                break
+    sections = []
+    heading = None
+    section_start = start
+    tasks_start = None
+    tasks_end = len(lines)
+    for i in range(start, len(lines)):
+        line = lines[i]
+        # "#тег" в начале строки - не заголовок
+        if not line.startswith('#') or not HEADING.match(line):
+            continue
+        if heading is not None or i > section_start:
+            sections.append((heading, '\n'.join(lines[section_start:i])))
+        if tasks_start is not None and tasks_end == len(lines):
+            tasks_end = i
+        heading = line.lstrip('#').strip()
+        section_start = i + 1
+        if tasks_start is None and heading == 'Tasks':
+            tasks_start = i + 1
+    if heading is not None or section_start < len(lines):
+        sections.append((heading, '\n'.join(lines[section_start:])))
+    if tasks_start is None:
+        logging.warning("Block with tasks wasn't found")
+        tasks = ()
+    else:
+        with stage('tasks_regex') as timer:
+            tasks = _parse_tasks(lines[tasks_start:tasks_end], default_reward)
+            timer.rows = len(tasks)
+        if len(tasks) == 0:
+            logging.warning("There's no tasks in note")
+    with stage('frontmatter') as timer:
+        habits = _parse_habits(frontmatter)
+        timer.rows = len(habits)
+    return ParsedNote(frontmatter, tuple(sections), tasks, habits)
+
+
 class DailyNote:
     # Class for daily note
     vault_path = VAULT_PATH
     default_reward_for_task = 1
+    use_cache = NOTE_CACHE
     def __init__(self, date):
         self.date = date
         self.note_name = dt.date.isoformat(date) + '.md'
-        self._note_content = ''
+        self._note_content = None
+        self._parsed = None
 
     def __str__(self) -> str:
         return dt.date.isoformat(self.date)
 
     @classmethod
     def get_daily_notes_list(cls):
-        filepath = os.path.join(cls.vault_path)
-        file_list = os.listdir(filepath)
-        return [dt.date.fromisoformat(d.replace('.md', '')) for d in file_list]
+        # файлы, имя которых не дата, пропускаются
+        with os.scandir(cls.vault_path) as it:
+            dates = [note_date(entry.name) for entry in it]
+        return sorted(d for d in dates if d is not None)
 
     @classmethod
     def get_first_date(cls):
@@ -43,10 +298,11 @@ class DailyNote:
 
     @property
     def note_content(self) -> str:
-        if hasattr(self, '_note_content'):
+        if self._note_content is None:
             filepath = os.path.join(self.vault_path, self.note_name)
             try:
-                with open (filepath, 'r', encoding='utf-8') as f:
+                with stage('note_read', rows=1), \
+                        open (filepath, 'r', encoding='utf-8') as f:
                     self._note_content = f.read()
             except FileNotFoundError as ex:
                 logging.error(
@@ -67,46 +323,57 @@ class DailyNote:
 {'\n'.join([i.__str__() for i in self.habits_list]) or "нет привычек"}'''
 
     @property
-    def tasks_list(self) -> list:
-        tasks_block = re.search(r'# Tasks\s*(.*)', self.note_content, re.DOTALL)
-        if not tasks_block:
-            logging.warning("Block with tasks wasn't found")
-            return []
-        task_lines = tasks_block.group(1).splitlines()
-        task_pattern = re.compile(r"- \[( |x)\] ([A-zА-я0-9\s]+)")
-        reward_pattern = re.compile(r".*\((\d+)\)")
-        tasks = []
-        for line in task_lines:
-            match = task_pattern.match(line.strip())
-            if match:
-                is_done = match.group(1) != " "
-                name = match.group(2).strip()
-                reward = reward_pattern.match(line)
-                if reward:
-                    reward = int(reward.group(1))
+    def parsed(self) -> ParsedNote:
+        # заметка читается и разбирается один раз на объект. Если заметка
+        # не менялась с прошлого разбора, результат берется из кэша на диске
+        if self._parsed is None:
+            cache = None
+            if self.use_cache and self._note_content is None:
+                cache = get_note_cache()
+                path = os.path.join(self.vault_path, self.note_name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    cache = None
                 else:
-                    reward = self.default_reward_for_task
-                comment = None
-                tasks.append(Task(is_done, name, reward, comment))
-        if len(tasks) == 0:
-            logging.warning("There's no tasks in note")
-        return tasks
+                    self._parsed = cache.get(path, stat)
+            if self._parsed is None:
+                self._parsed = parse_note(
+                    self.note_content, self.default_reward_for_task
+                )
+                if cache is not None:
+                    cache.put(path, stat, self._parsed)
+        return self._parsed
+
+    @property
+    def day_bounds(self) -> tuple:
+        values = {h.name: h.value for h in self.parsed.habits
+                  if h.name in DATETIME_HABITS}
+        return day_bounds(
+            self.date, values.get('Day begin'), values.get('Day end')
+        )
+
+    @property
+    def day_begin(self):
+        return self.day_bounds[0]
+
+    @property
+    def day_end(self):
+        return self.day_bounds[1]
+
+    @property
+    def tasks_list(self) -> list:
+        return list(self.parsed.tasks)
 
     @property
     def habits_list(self) -> list:
-        match = re.search(r"---\s*\n(.*?)\n---", self.note_content, re.DOTALL)
-        if not match:
-            return []
-        try:
-            habits_list = yaml.safe_load(match.group(1))
-        except yaml.YAMLError as e:
-            logging.error(f"YAML wasn't read {e}")
-            raise
-        return [Habit(k, v) for k, v in habits_list.items()]
+        return list(self.parsed.habits)
 
 
 class Task:
     '''Класс для задачи'''
+    __slots__ = ('is_done', 'name', 'reward', 'comment')
+
     def __init__(self, is_done, name, reward, comment):
         self.is_done = is_done
         self.name = name
@@ -119,8 +386,14 @@ class Task:
         return f'Задача "{self.name}" {get_reward}'
 
 
+# время привычки в значении вида "07:30"
+_HABIT_TIME = re.compile(r'([0-9]{1,2}):([0-9]{2})')
+
+
 class Habit:
     '''Класс для привычек'''
+    __slots__ = ('name', 'value')
+
     def __init__(self, name, value):
         if not isinstance(name, str):
             raise TypeError('"name" atribute must be str')
@@ -129,7 +402,102 @@ class Habit:
     
     def __str__(self):
         return self.name + ' - ' + str(self.value)
-    
+
+    @property
+    def value_int(self):
+        # значение для колонки value в dailyhabits: да/нет - 1/0, время
+        # "07:30" - минуты от начала дня, то, что не число, - None
+        value = self.value
+        if isinstance(value, bool):
+            return int(value)
+        if isinstance(value, int):
+            return value
+        if isinstance(value, float):
+            return round(value)
+        if isinstance(value, str):
+            value = value.strip()
+            # числа в кавычках остаются числами, fromisoformat прочитал бы
+            # "12" и "1230" как время
+            try:
+                return round(float(value))
+            except (ValueError, OverflowError):
+                pass
+            match = _HABIT_TIME.fullmatch(value)
+            if match is None:
+                return None
+            hours, minutes = int(match[1]), int(match[2])
+            if hours > 23 or minutes > 59:
+                return None
+            return hours * 60 + minutes
+        return None
+
+
+class NotesBatch:
+    '''Задачи и привычки многих заметок, разложенные по колонкам (списки
+    значений вместо списка объектов). Из колонок DataFrame собирается
+    одним вызовом'''
+    __slots__ = (
+        'dates',
+        'task_date', 'task_name', 'task_is_done', 'task_reward',
+        'task_comment',
+        'habit_date', 'habit_name', 'habit_value',
+        'day_begin', 'day_end',
+    )
+
+    def __init__(self, notes=()):
+        for column in self.__slots__:
+            setattr(self, column, [])
+        for note in notes:
+            self.add(note)
+
+    def __len__(self):
+        return len(self.dates)
+
+    def add(self, note):
+        date = dt.datetime.combine(note.date, dt.time(0, 0, 0))
+        self.dates.append(date)
+        parsed = note.parsed
+        day_begin, day_end = note.day_bounds
+        self.day_begin.append(day_begin)
+        self.day_end.append(day_end)
+        for t in parsed.tasks:
+            self.task_date.append(date)
+            self.task_name.append(t.name)
+            self.task_is_done.append(t.is_done)
+            self.task_reward.append(t.reward)
+            self.task_comment.append(t.comment)
+        for h in parsed.habits:
+            self.habit_date.append(date)
+            self.habit_name.append(h.name)
+            self.habit_value.append(h.value)
+
+    def tasks_frame(self):
+        import pandas as pd
+        return pd.DataFrame({
+            'date': self.task_date,
+            'name': self.task_name,
+            'is_done': self.task_is_done,
+            'reward': self.task_reward,
+            'comment': self.task_comment,
+        })
+
+    def days_frame(self):
+        import pandas as pd
+        return pd.DataFrame({
+            'date': self.dates,
+            'day_begin': pd.to_datetime(self.day_begin),
+            'day_end': pd.to_datetime(self.day_end),
+        })
+
+    def habits_frame(self):
+        import pandas as pd
+        return pd.DataFrame({
+            'date': self.habit_date,
+            'name': self.habit_name,
+            'value': self.habit_value,
+        })
+
+
 if __name__ == '__main__':
     d = DailyNote(dt.date(2025, 8, 1))
     print(d.tasks_list)
\ No newline at end of file
@@ -0,0 +1,120 @@
+'''pipeline.py
+Асинхронный конвейер загрузки: разбор заметок и запись идут одновременно,
+стадии связаны очередями ограниченного размера. Заметки читаются и
+разбираются в пуле процессов (или потоков) через DailyNote.parsed, то есть
+с кэшем разобранных заметок, запись идет в одном отдельном потоке через
+writer из backfill (DataBaseWriter или RegisterWriter). max_pending
+ограничивает число заметок, ожидающих в каждой очереди, а значит и занятую
+память. Запуск: python main.py backfill --pipeline
+'''
+import os
+import asyncio
+import logging
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from backfill import parse_daily_note, merge_stats, init_worker
+
+
+class Pipeline:
+    def __init__(
+        self,
+        writer,
+        workers:int=None,
+        max_pending:int=64,
+        batch_size:int=100,
+        use_processes:bool=True
+    ):
+        self.writer = writer
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self.use_processes = use_processes
+        self.loaded = 0
+        self.failed = 0
+
+    async def dates_stage(self, dates, out_queue):
+        for date in dates:
+            await out_queue.put(date)
+        for _ in range(self.workers):
+            await out_queue.put(None)
+
+    async def parse_stage(self, pool, in_queue, out_queue):
+        loop = asyncio.get_running_loop()
+        while (date := await in_queue.get()) is not None:
+            date, note, error = merge_stats(await loop.run_in_executor(
+                pool, parse_daily_note, date
+            ))
+            if error is not None:
+                logging.error(f'Заметку за {date.isoformat()} разобрать не'
+                              f' удалось: {error}')
+                continue
+            await out_queue.put(note)
+        await out_queue.put(None)
+
+    def write_batch(self, batch):
+        batch.sort(key=lambda n: n.date)
+        for note in batch:
+            self.writer.write(note)
+        self.writer.flush()
+
+    async def write_stage(self, in_queue):
+        loop = asyncio.get_running_loop()
+        # один поток, чтобы соединение с БД использовалось из одного места
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            finished = 0
+            batch = []
+            while finished < self.workers:
+                note = await in_queue.get()
+                if note is None:
+                    finished += 1
+                else:
+                    batch.append(note)
+                if batch and (len(batch) >= self.batch_size
+                              or finished == self.workers):
+                    await self.flush(loop, executor, batch)
+                    batch = []
+
+    async def flush(self, loop, executor, batch):
+        try:
+            await loop.run_in_executor(executor, self.write_batch, batch)
+        except Exception as ex:
+            logging.error(
+                f'Заметки за {batch[0].date.isoformat()} - '
+                f'{batch[-1].date.isoformat()} загрузить не удалось: {ex}'
+            )
+
+    async def run_async(self, dates):
+        dates_queue = asyncio.Queue(maxsize=self.max_pending)
+        write_queue = asyncio.Queue(maxsize=self.max_pending)
+        if self.use_processes:
+            pool = ProcessPoolExecutor(
+                max_workers=self.workers, initializer=init_worker
+            )
+        else:
+            pool = ThreadPoolExecutor(max_workers=self.workers)
+        with pool:
+            await asyncio.gather(
+                self.dates_stage(dates, dates_queue),
+                *(self.parse_stage(pool, dates_queue, write_queue)
+                  for _ in range(self.workers)),
+                self.write_stage(write_queue),
+            )
+
+    def run(self, dates) -> tuple:
+        '''Загружает заметки за dates. Возвращает количество загруженных и
+        пропущенных заметок'''
+        dates = list(dates)
+        try:
+            asyncio.run(self.run_async(dates))
+        except Exception as ex:
+            logging.error(f'Конвейер остановлен с ошибкой: {ex}')
+        finally:
+            # записанное к этому моменту сохраняется и при ошибке или Ctrl-C
+            try:
+                self.writer.close()
+            except Exception as ex:
+                logging.error(f'Заметки сохранить не удалось: {ex}')
+        self.loaded = self.writer.loaded
+        self.failed = len(dates) - self.loaded
+        logging.info(f'Конвейер завершен: загружено {self.loaded},'
+                     f' с ошибками {self.failed}')
+        return self.loaded, self.failed
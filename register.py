@@ -1,38 +1,173 @@
 # register.py
 # saves habits, tasks and days into csv files
 
+import numpy as np
 import pandas as pd
 import datetime as dt
 import obsidian as o
 from obsidian import FileFormatError
 import os
-from config import DATA_DIR
+from config import DATA_DIR, REGISTER_STORAGE
+import storage
+from metrics import stage
 
 
 class BaseStatistics:
+    '''Таблица register в памяти. Строки держатся отсортированными по
+    (date, name), поэтому строки дня или диапазона дат находятся бинарным
+    поиском по колонке date (rows_for, range, replace_day), а не маской по
+    всей таблице'''
     template: pd.DataFrame = None
     filename: str = None
     types_dict = None
+    # колонка с датой, по которой хранилище фильтрует и делит таблицу
+    date_column = 'date'
 
-    def __init__(self):
+    def __init__(self, date_from:dt.date=None, date_to:dt.date=None):
+        # date_from/date_to - загрузить только часть истории
         self.path = os.path.join(DATA_DIR, self.filename)
-        if not os.path.exists(self.path):
-            self.template.to_csv(self.path, sep=';')
-            self.data = self.template.copy()
-        else:
-            self.data = self.load_from_csv()
-        self.data = self.data.astype(self.types_dict)
+        self.storage = self.open_storage()
+        self.is_full = date_from is None and date_to is None
+        self.data = self.storage.load(date_from, date_to)
+        self.data = self.sorted(self.data.astype(self.types_dict))
+        # даты, измененные с момента загрузки; None - менялась вся таблица
+        self.changed_dates = set()
         self.dates = o.DailyNote.get_daily_notes_list()
 
+    @classmethod
+    def open_storage(cls):
+        # хранилище таблицы без загрузки данных, например для iter_months
+        return storage.backends[REGISTER_STORAGE](
+            os.path.join(DATA_DIR, cls.filename),
+            cls.template,
+            cls.types_dict,
+            cls.date_column
+        )
+
+    @property
+    def sort_columns(self) -> list:
+        return [c for c in (self.date_column, 'name')
+                if c in self.template.columns]
+
+    def sorted(self, data:pd.DataFrame) -> pd.DataFrame:
+        return data.sort_values(self.sort_columns, kind='stable')\
+            .reset_index(drop=True)
+
+    @staticmethod
+    def _date_key(values:np.ndarray, date):
+        # дата в единицах колонки date, чтобы searchsorted не приводил всю
+        # колонку к другому типу
+        return pd.Timestamp(date).to_datetime64().astype(values.dtype)
+
+    def bounds(self, date_from=None, date_to=None) -> tuple:
+        '''Позиции [начало, конец) строк за date_from..date_to включительно'''
+        values = self.data[self.date_column].to_numpy()
+        start, end = 0, len(values)
+        if date_from is not None:
+            start = int(values.searchsorted(
+                self._date_key(values, date_from), side='left'
+            ))
+        if date_to is not None:
+            end = int(values.searchsorted(
+                self._date_key(values, date_to), side='right'
+            ))
+        return start, max(start, end)
+
+    def rows_for(self, date) -> pd.DataFrame:
+        '''Строки за один день'''
+        start, end = self.bounds(date, date)
+        return self.data.iloc[start:end]
+
+    def range(self, start=None, end=None) -> pd.DataFrame:
+        '''Строки за start..end включительно, границы необязательны'''
+        start, end = self.bounds(start, end)
+        return self.data.iloc[start:end]
+
+    def replace_day(self, date, rows:pd.DataFrame=None):
+        '''Заменяет строки за date строками rows (пустые rows - удаляет
+        день). Меняется только срез дня, остальная таблица не
+        просматривается'''
+        start, end = self.bounds(date, date)
+        parts = [self.data.iloc[:start]]
+        if rows is not None and len(rows.index):
+            rows = rows[self.template.columns].astype(self.types_dict)
+            rows = rows.assign(**{self.date_column: pd.Timestamp(date)})
+            parts.append(rows.sort_values(self.sort_columns, kind='stable'))
+        parts.append(self.data.iloc[end:])
+        self.data = self.concat(parts)
+        if self.changed_dates is not None:
+            self.changed_dates.add(pd.Timestamp(date).date())
+
+    def concat(self, parts) -> pd.DataFrame:
+        data = pd.concat(parts, ignore_index=True)
+        # concat теряет категории, если в одной из частей их нет
+        return data.astype({c: t for c, t in self.data.dtypes.items()
+                            if isinstance(t, pd.CategoricalDtype)})
+
     def load_from_csv(self):
+        # справочники без журнала: они маленькие и сохраняются целиком
         data = pd.read_csv(self.path, sep=';', index_col=0)
         return data.astype(self.template.dtypes.to_dict())
 
+    def push(self):
+        # если известны измененные дни, сохраняются только они: в csv они
+        # дописываются в журнал, в parquet перезаписываются их месяцы
+        with stage(f'register_push {self.filename}') as timer:
+            if self.changed_dates is None:
+                if not self.is_full:
+                    raise ValueError(
+                        'Table was loaded partially and can be saved only by'
+                        ' days'
+                    )
+                self.storage.save(self.data)
+                timer.rows = len(self.data.index)
+            elif self.changed_dates:
+                start, end = self.bounds(
+                    min(self.changed_dates), max(self.changed_dates)
+                )
+                self.storage.replace_dates(
+                    self.data.iloc[start:end], self.changed_dates
+                )
+                timer.rows = end - start
+        self.changed_dates = set()
+
     def push_to_csv(self):
-        self.data\
-            .sort_values(by='date')\
-            .reset_index(drop=True)\
-            .to_csv(self.path, sep=';')
+        self.push()
+
+    def batch_frame(self, batch:o.NotesBatch) -> pd.DataFrame:
+        # строки таблицы для пачки заметок, определяется в наследниках
+        raise NotImplementedError
+
+    def load_notes(self, notes):
+        '''Загружает пачку заметок: строки собираются в один DataFrame.
+        Если все даты пачки позже загруженных, строки просто дописываются в
+        конец, иначе ранее загруженные данные за эти даты удаляются одной
+        маской и таблица пересортировывается'''
+        notes = list(notes)
+        if not notes:
+            return
+        with stage(f'register_append {self.filename}') as timer:
+            batch = o.NotesBatch(notes)
+            if self.changed_dates is not None:
+                self.changed_dates.update(n.date for n in notes)
+            new = self.batch_frame(batch)[self.template.columns]\
+                .astype(self.types_dict)
+            new = new.sort_values(self.sort_columns, kind='stable')
+            start, _ = self.bounds(min(batch.dates))
+            if start == len(self.data.index):
+                self.data = self.concat((self.data, new))
+            elif len(batch.dates) == 1:
+                self.replace_day(batch.dates[0], new)
+            else:
+                kept = self.data[~self.data['date'].isin(batch.dates)]
+                self.data = self.sorted(self.concat((kept, new)))
+            timer.rows = len(new)
+
+    def load_note(self, date=None, note=None):
+        # note - уже разобранная DailyNote, например из backfill
+        if note is None:
+            note = o.DailyNote(date if date is not None else max(self.dates))
+        self.load_notes([note])
 
     @property
     def dates_loaded(self):
@@ -45,8 +180,15 @@ class BaseStatistics:
         date:dt.date=None,
         intersect=True
     ):
+        if date is not None and not isinstance(date, dt.date):
+            raise TypeError('date argument must be date type')
+        if id is None and name is None and date is not None:
+            # удаление дня - срез по дате, известно, какой день изменился
+            self.replace_day(date)
+            return
+        self.changed_dates = None
         if id is None and name is None and date is None:
-            self.data = self.template
+            self.data = self.template.astype(self.types_dict)
             return
         if id is not None:
             if not isinstance(id, int):
@@ -63,16 +205,14 @@ class BaseStatistics:
         else:
             mask_name = True
         if date is not None:
-            if not isinstance(name, dt.date):
-                raise TypeError('name argument must be date type')
-            else:
-                mask_date = self.data['name'] != pd.to_datetime(date)
+            mask_date = self.data['date'] != pd.Timestamp(date)
         else:
             mask_date = True
         if intersect:
             self.data = self.data[(mask_id & mask_date & mask_name)]
         else:
             self.data = self.data[(mask_id | mask_date | mask_name)]
+        self.data = self.data.reset_index(drop=True)
 
 class TaskStatistics(BaseStatistics):
     template = pd.DataFrame(
@@ -91,27 +231,12 @@ class TaskStatistics(BaseStatistics):
     }
     filename = 'tasks.csv'
 
-    def __init__(self):
-        super().__init__()
-
-    def load_note(self, date=None):
-        if date is None:
-            date = max(self.dates)
-        note = o.DailyNote(date)
-        if pd.to_datetime(date) in self.dates_loaded.values:
-            self.data = self.data[self.data['date'] != pd.to_datetime(date)]
-        for t in note.tasks_list:
-            if len(self.data.index) != 0:
-                inserted_index = max(self.data.index) + 1
-            else:
-                inserted_index = 0
-            self.data.loc[inserted_index] = ({
-                'date': dt.datetime.combine(date, dt.time(0, 0, 0)),
-                'name': t.name,
-                'is_done': t.is_done,
-                'reward': t.reward}
-            )
-    
+    def __init__(self, date_from:dt.date=None, date_to:dt.date=None):
+        super().__init__(date_from, date_to)
+
+    def batch_frame(self, batch:o.NotesBatch) -> pd.DataFrame:
+        return batch.tasks_frame()
+
 
 class HabitsStatistics(BaseStatistics):
     template = pd.DataFrame(
@@ -129,36 +254,63 @@ class HabitsStatistics(BaseStatistics):
         'result': 'object'
     }
     filename = 'habits.csv'
+    type_categories = ('float', 'bool', 'str', 'datetime')
 
-    def __init__(self):
-        super().__init__()
+    def __init__(self, date_from:dt.date=None, date_to:dt.date=None):
+        super().__init__(date_from, date_to)
         self.data['type'] = pd.Categorical(
             self.data['type'],
-            categories=('float', 'bool', 'str', 'datetime')
+            categories=self.type_categories
         )
 
-    def load_note(self, date=None):
-        note = o.DailyNote(date)
-        if pd.to_datetime(date) in self.dates_loaded.values:
-            self.data = self.data[self.data['date'] != pd.to_datetime(date)]
-        note = o.DailyNote(date if date else max(self.dates))
-        for h in note.habits_list:
-            inserted_id = max(self.data.index) + 1
-            if isinstance(h.value, bool):
-                inserted_type = 'bool'
-            elif isinstance(h.value, (float, int)):
-                inserted_type = 'float'
-            elif isinstance(h.value, str):
-                inserted_type = 'str'
-            elif isinstance(h.value, dt.datetime):
-                inserted_type = 'datetime'
-            else:
-                continue
-            self.data.loc[inserted_id, ['date', 'name', 'type', 'result']] =\
-                [date, h.name, inserted_type, str(h.value)]
+    @staticmethod
+    def habit_type(value):
+        if isinstance(value, bool):
+            return 'bool'
+        elif isinstance(value, (float, int)):
+            return 'float'
+        elif isinstance(value, str):
+            return 'str'
+        elif isinstance(value, dt.datetime):
+            return 'datetime'
+        return None
+
+    def batch_frame(self, batch:o.NotesBatch) -> pd.DataFrame:
+        data = batch.habits_frame()
+        data['type'] = [self.habit_type(v) for v in batch.habit_value]
+        data['result'] = [str(v) for v in batch.habit_value]
+        return data[data['type'].notna()]
+
+    def load_notes(self, notes):
+        super().load_notes(notes)
+        self.data['type'] = pd.Categorical(
+            self.data['type'], categories=self.type_categories
+        )
+
+
+class SleepStatistics(BaseStatistics):
+    # подъем и отход ко сну из "Day begin" и "Day end" заметки
+    template = pd.DataFrame(
+        columns=(
+            'date',
+            'day_begin',
+            'day_end'
+        )
+    )
+    types_dict = {
+        'date': 'datetime64[s]',
+        'day_begin': 'datetime64[s]',
+        'day_end': 'datetime64[s]'
+    }
+    filename = 'sleep.csv'
+
+    def __init__(self, date_from:dt.date=None, date_to:dt.date=None):
+        super().__init__(date_from, date_to)
+
+    def batch_frame(self, batch:o.NotesBatch) -> pd.DataFrame:
+        return batch.days_frame()
 
 if __name__ == '__main__':
     t = TaskStatistics()
-    for i in range(1, 10):
-        t.load_note(dt.date(2025, 8, i))
+    t.load_notes(o.DailyNote(dt.date(2025, 8, i)) for i in range(1, 10))
     t.push_to_csv()
\ No newline at end of file
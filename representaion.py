@@ -6,6 +6,7 @@ import pandas as pd
 import register
 import dictionaries
 import datetime as dt
+from metrics import stage
 
 
 class TasksRep(register.BaseStatistics):
@@ -19,23 +20,34 @@ class TasksRep(register.BaseStatistics):
             'earned_reward'
         ]
     )
-    template = template.astype({
+    types_dict = {
         'date': 'datetime64[s]',
         'task': 'object',
         'reward': 'Int16',
         'completed': 'bool',
         'earned_reward': 'Int16'
-    })
+    }
+    template = template.astype(types_dict)
 
-    def __init__(self):
-        super().__init__()
+    def __init__(self, date_from:dt.date=None, date_to:dt.date=None):
+        super().__init__(date_from, date_to)
 
     def get_registered_data(self):
         return register.TaskStatistics().data
 
+    @classmethod
+    def calc_chunk(cls, tasks:pd.DataFrame) -> pd.DataFrame:
+        # отчет по задачам для любой части истории
+        return pd.DataFrame({
+            'date': tasks['date'],
+            'task': tasks['name'],
+            'reward': tasks['reward'],
+            'completed': tasks['is_done'],
+            'earned_reward': tasks['reward'].where(tasks['is_done'], 0),
+        }).astype(cls.types_dict)
+
     def calc_data(self):
-        self.data = self.get_registered_data()
-        self.data['earned'] = self.data['reward'] * self.data['is_done']
+        self.data = self.calc_chunk(self.get_registered_data())
 
 
 class HabitsRep(register.BaseStatistics):
@@ -67,8 +79,8 @@ class HabitsRep(register.BaseStatistics):
             'is_negative':'bool'
         }
 
-    def __init__(self):
-        super().__init__()
+    def __init__(self, date_from:dt.date=None, date_to:dt.date=None):
+        super().__init__(date_from, date_to)
         self.data['type'] = pd.Categorical(
             self.data['type'], 
             categories=('float', 'bool', 'str', 'datetime')
@@ -77,48 +89,114 @@ class HabitsRep(register.BaseStatistics):
     def get_registered_data(self):
         return register.HabitsStatistics().data
 
+    @property
+    def rules(self):
+        # правила читаются с диска один раз на объект
+        if getattr(self, '_rules', None) is None:
+            self._rules = dictionaries.RegisterRules().data
+        return self._rules
+
+    @staticmethod
+    def to_minutes(result:pd.Series) -> pd.Series:
+        # "07:30" -> 450, числа остаются как есть
+        parts = result.astype(str).str.extract(r'^(\d{1,2}):(\d{2})')
+        minutes = pd.to_numeric(parts[0], errors='coerce') * 60 \
+            + pd.to_numeric(parts[1], errors='coerce')
+        return minutes.fillna(pd.to_numeric(result, errors='coerce'))
+
+    @classmethod
+    def evaluate(cls, data:pd.DataFrame, rules:pd.DataFrame) -> pd.DataFrame:
+        '''Оценивает все привычки из data (date, name, result) разом: правило
+        на дату подбирается через merge_asof по valid_from, выполнение и
+        награда считаются масками по колонкам'''
+        with stage('rules_evaluate', rows=len(data)):
+            return cls._evaluate(data, rules)
+
+    @classmethod
+    def _evaluate(cls, data:pd.DataFrame, rules:pd.DataFrame) -> pd.DataFrame:
+        rules = rules[
+            ['name', 'valid_from', 'type', 'target', 'reward', 'is_negative',
+             'unit']
+        ].rename(columns={'type': 'rule_type'})
+        # merge_asof требует одинаковых типов name, а pandas 3 создает
+        # строковые колонки как str
+        rules = rules.astype({'valid_from': 'datetime64[ns]', 'name': object})\
+            .sort_values('valid_from')
+        out = data.reset_index(drop=True).astype({'name': object})
+        out['_order'] = out.index
+        out['_date'] = out['date'].astype('datetime64[ns]')
+        out = out.drop(
+            columns=[c for c in rules.columns if c in out.columns
+                     and c != 'name'],
+        )
+        out = pd.merge_asof(
+            out.sort_values('_date'),
+            rules,
+            left_on='_date',
+            right_on='valid_from',
+            by='name',
+            direction='backward'
+        ).sort_values('_order')
+
+        is_negative = out['is_negative'].astype('boolean').fillna(False)\
+            .astype(bool)
+        rule_type = out['rule_type']
+        result = out['result'].astype(str)
+        numeric = pd.to_numeric(result, errors='coerce')
+        numeric = numeric.where(rule_type != 'time', cls.to_minutes(result))
+        target = pd.to_numeric(out['target'], errors='coerce')
+        flag = result.str.strip().str.lower().isin(('true', '1', '1.0'))
+
+        is_numeric = rule_type.isin(('float', 'time'))
+        completed = pd.Series(False, index=out.index)
+        completed = completed.mask(
+            is_numeric & is_negative, numeric < target)
+        completed = completed.mask(
+            is_numeric & ~is_negative, numeric >= target)
+        completed = completed.mask(rule_type == 'bool', flag ^ is_negative)
+        completed = completed.fillna(False).astype(bool)
+
+        out['completed'] = completed
+        out['earned'] = out['reward'].where(completed, 0)\
+            .where(rule_type.notna())
+        out['is_negative'] = is_negative
+        out['str_value'] = (
+            result + ' ' + out['unit'].fillna('').astype(str)
+        ).str.strip()
+        return out.drop(
+            columns=['_order', '_date', 'valid_from', 'rule_type', 'unit']
+        ).reset_index(drop=True)
+
     def eval_habit(self, habit:str, result:str, date=None):
-        date = dictionaries.Habit.validate_date(date)
-        actual_rules = dictionaries.RegisterRules().get_actual_rules(as_of_date=date)
-        needed_habit = actual_rules.query("name == @habit")
-        earned = 0
-        completed_flag = False
-        result = float(result)
-        match needed_habit.iat[0, 4]:
-            case 'float' | 'time':
-                if needed_habit.iat[0, 2]:
-                    earned = needed_habit['reward'].iat[0] \
-                        if result < float(needed_habit['target'].iat[0]) else 0
-                    completed_flag = False \
-                        if result < float(needed_habit['target'].iat[0]) \
-                        else True
-                else:
-                    earned = needed_habit['reward'].iat[0] \
-                        if result >= float(needed_habit['target'].iat[0]) else 0
-                    completed_flag = True \
-                        if result < float(needed_habit['target'].iat[0]) \
-                        else True
-            case 'bool':
-                if needed_habit.iat[0, 2]:
-                    earned = needed_habit['reward'].iat[0] if not result else 0
-                    completed_flag = not result
-                else:
-                    earned = needed_habit['reward'].iat[0] if result else 0
-                    completed_flag =  result
-        return earned, \
-            needed_habit['target'].iat[0], \
-            completed_flag, \
-            (str(result) + ' ' + needed_habit['unit'].iat[0]).strip()
+        date = dictionaries.Habit.validate_date(date, dt.date.today())
+        row = self.evaluate(
+            pd.DataFrame(
+                {'date': [pd.Timestamp(date)], 'name': [habit],
+                 'result': [result]}
+            ),
+            self.rules
+        ).iloc[0]
+        return row['earned'], row['target'], row['completed'], row['str_value']
+
+    @classmethod
+    def calc_chunk(cls, habits:pd.DataFrame, rules:pd.DataFrame):
+        return cls.evaluate(habits, rules)[cls.template.columns]\
+            .astype(cls.types_dict)
 
+    def calc_data(self):
+        self.data = self.calc_chunk(self.get_registered_data(), self.rules)
 
     def fill_table(self):
-        mask = self.data[self.data['earned'].isna()]
-        self.data.loc[mask, ['earned', 'reward', 'str_value', 'completed']] = (
-            self.data.loc[mask, ['name', 'result', 'date']]
-            .apply(lambda row : self.eval_habit(
-                row['name'], row['result'], row['date']), axis=1)
-            .apply(pd.Series)
+        # досчитывает строки, для которых награда еще не посчитана
+        mask = self.data['earned'].isna()
+        if not mask.any():
+            return
+        columns = ['earned', 'target', 'completed', 'str_value', 'reward',
+                   'is_negative']
+        evaluated = self.evaluate(
+            self.data.loc[mask, ['date', 'name', 'result']], self.rules
         )
+        self.data.loc[mask, columns] = evaluated[columns].values
 
 
     '''
@@ -136,24 +214,255 @@ class HabitsRep(register.BaseStatistics):
 class DatesRep(register.BaseStatistics):
     template = pd.DataFrame(
         columns=[
+            'date',
             'tasks_reward',
             'habits_reward',
             'reward',
             'max_tasks_reward',
             'max_habits_reward',
-            'max_reward'
+            'max_reward',
+            'balance'
         ]
     )
-    template = template.astype({
+    types_dict = {
+        'date': 'datetime64[s]',
         'tasks_reward': 'Int32',
         'habits_reward': 'Int32',
         'reward': 'Int32',
         'max_tasks_reward': 'Int32',
         'max_habits_reward': 'Int32',
-        'max_reward': 'Int32'
-    })
+        'max_reward': 'Int32',
+        'balance': 'Int32'
+    }
+    template = template.astype(types_dict)
     filename = 'days.csv'
 
+    def __init__(self, date_from:dt.date=None, date_to:dt.date=None):
+        super().__init__(date_from, date_to)
+        self._rules = None
+
+    @property
+    def rules(self):
+        if self._rules is None:
+            self._rules = dictionaries.RegisterRules().data
+        return self._rules
+
+    @classmethod
+    def calc_chunk(cls, tasks_rep:pd.DataFrame, habits_rep:pd.DataFrame,
+                   balance:int=0) -> pd.DataFrame:
+        '''Итоги по дням из отчетов по задачам и привычкам. balance - баланс
+        на конец предыдущего дня'''
+        tasks = tasks_rep.groupby('date').agg(
+            tasks_reward=('earned_reward', 'sum'),
+            max_tasks_reward=('reward', 'sum'),
+        )
+        habits = habits_rep.groupby('date').agg(
+            habits_reward=('earned', 'sum'),
+            max_habits_reward=('reward', 'sum'),
+        )
+        out = tasks.join(habits, how='outer').fillna(0)
+        out['reward'] = out['tasks_reward'] + out['habits_reward']
+        out['max_reward'] = out['max_tasks_reward'] + out['max_habits_reward']
+        out['balance'] = balance + out['reward'].cumsum()
+        return out.reset_index()[cls.template.columns].astype(cls.types_dict)
+
+    def update_dates(self, tasks:pd.DataFrame, habits:pd.DataFrame, dates):
+        '''Пересчитывает итоги только за dates по строкам регистров tasks и
+        habits за эти даты, после чего досчитывает баланс начиная с самой
+        ранней из них. Остальные дни не трогаются'''
+        dates = pd.to_datetime(list(dates))
+        if len(dates) == 0:
+            return
+        new = self.calc_chunk(
+            TasksRep.calc_chunk(tasks[tasks['date'].isin(dates)]),
+            HabitsRep.calc_chunk(habits[habits['date'].isin(dates)],
+                                 self.rules)
+        )
+        kept = self.data[~self.data['date'].isin(dates)]
+        self.data = pd.concat((kept, new), ignore_index=True)\
+            .sort_values('date', kind='stable')\
+            .reset_index(drop=True)
+        start = dates.min()
+        downstream = self.data['date'] >= start
+        before = self.data.loc[~downstream, 'balance']
+        balance = before.iloc[-1] if len(before.index) else 0
+        self.data.loc[downstream, 'balance'] = \
+            balance + self.data.loc[downstream, 'reward'].cumsum()
+        # баланс изменился у всех дней после start
+        if self.changed_dates is not None:
+            self.changed_dates.update(
+                self.data.loc[downstream, 'date'].dt.date
+            )
+            self.changed_dates.update(dates.date)
+
+    def refresh(self, tasks:register.TaskStatistics,
+                habits:register.HabitsStatistics, dates):
+        # то же по загруженным таблицам регистров
+        self.update_dates(tasks.data, habits.data, dates)
+
+
+class SleepRep(register.BaseStatistics):
+    filename = 'sleep_report.csv'
+    template = pd.DataFrame(
+        columns=[
+            'date',
+            'day_begin',
+            'day_end',
+            'slept',
+            'reward'
+        ]
+    )
+    types_dict = {
+        'date': 'datetime64[s]',
+        'day_begin': 'datetime64[s]',
+        'day_end': 'datetime64[s]',
+        'slept': 'Int32',
+        'reward': 'Int16'
+    }
+
+    def __init__(self, date_from:dt.date=None, date_to:dt.date=None):
+        super().__init__(date_from, date_to)
+        self._rewards = None
+
+    @property
+    def rewards(self) -> dictionaries.SleepRewards:
+        if self._rewards is None:
+            self._rewards = dictionaries.SleepRewards()
+        return self._rewards
+
+    @staticmethod
+    def measures(days:pd.DataFrame) -> pd.DataFrame:
+        '''Показатели сна в минутах: slept - от отхода ко сну в заметке за
+        предыдущий день до подъема (через полночь), begin и end - от полуночи
+        даты заметки. Если заметки за предыдущий день нет, slept пустой'''
+        date = days['date'].astype('datetime64[ns]')
+        begin = days['day_begin'].astype('datetime64[ns]')
+        end = days['day_end'].astype('datetime64[ns]')
+        minute = pd.Timedelta(minutes=1)
+        follows = (date - date.shift()) == pd.Timedelta(days=1)
+        return pd.DataFrame({
+            'slept': ((begin - end.shift()) / minute).where(follows),
+            'begin': (begin - date) / minute,
+            'end': (end - date) / minute,
+        })
+
+    @classmethod
+    def evaluate(cls, days:pd.DataFrame,
+                 rewards:dictionaries.SleepRewards) -> pd.DataFrame:
+        '''Оценивает сон за все дни из days (date, day_begin, day_end) за
+        один проход: версия таблицы наград на каждую дату ищется бинарным
+        поиском, дни сводятся с полосами наград одним merge'''
+        with stage('sleep_evaluate', rows=len(days)):
+            out = days[['date', 'day_begin', 'day_end']]\
+                .sort_values('date').reset_index(drop=True)
+            measures = cls.measures(out)
+            out['slept'] = measures['slept'].round()
+            long = measures.rename_axis('row').reset_index().melt(
+                id_vars='row', var_name='measure', value_name='value'
+            ).dropna(subset=['value'])
+            long['valid_from'] = rewards.versions_for(out['date'])[long['row']]
+            bands = long.merge(
+                rewards.data[['measure', 'lower', 'upper', 'reward',
+                              'valid_from']],
+                on=['valid_from', 'measure']
+            )
+            hit = (bands['lower'].isna() | (bands['value'] >= bands['lower'])) \
+                & (bands['upper'].isna() | (bands['value'] < bands['upper']))
+            out['reward'] = bands.loc[hit].groupby('row')['reward'].sum()\
+                .reindex(out.index, fill_value=0)
+            return out[cls.template.columns].astype(cls.types_dict)
+
+    def calc_data(self, days:pd.DataFrame=None):
+        # days - строки SleepStatistics, по умолчанию читаются с диска.
+        # Вся история считается за миллисекунды, поэтому отчет всегда
+        # пересчитывается целиком
+        if days is None:
+            days = register.SleepStatistics().data
+        self.changed_dates = None
+        self.data = self.evaluate(days, self.rewards)
+
+
+def zip_months(*iterators):
+    '''Сводит несколько потоков (YYYY-MM, DataFrame) по месяцам. Если в
+    каком-то потоке месяца нет, на его месте None'''
+    heads = [next(it, None) for it in iterators]
+    while any(h is not None for h in heads):
+        key = min(h[0] for h in heads if h is not None)
+        frames = []
+        for i, it in enumerate(iterators):
+            if heads[i] is not None and heads[i][0] == key:
+                frames.append(heads[i][1])
+                heads[i] = next(it, None)
+            else:
+                frames.append(None)
+        yield key, frames
+
+
+def opening_balance(date_from:dt.date=None) -> int:
+    '''Баланс на конец дня перед date_from по сохраненному отчету по дням'''
+    balance = 0
+    if date_from is None:
+        return balance
+    for _, days in DatesRep.open_storage().iter_months(
+        date_to=pd.Timestamp(date_from) - pd.Timedelta(days=1)
+    ):
+        balance = int(days['balance'].iloc[-1])
+    return balance
+
+
+def stream_reports(date_from:dt.date=None, date_to:dt.date=None,
+                   balance:int=None, chunksize:int=50000):
+    '''Считает отчеты по задачам, привычкам и дням помесячно и пишет их по
+    мере готовности, так что в памяти только один месяц истории. balance -
+    баланс до date_from, по умолчанию берется из сохраненного отчета по
+    дням. Возвращает баланс на конец периода. Отчеты за дни вне периода
+    остаются как были, только баланс дней после date_to сдвигается на
+    столько, на сколько изменился баланс на конец периода'''
+    if balance is None:
+        balance = opening_balance(date_from)
+    stored_end = None
+    if date_to is not None:
+        stored_end = opening_balance(
+            pd.Timestamp(date_to) + pd.Timedelta(days=1)
+        )
+
+    def shift_balance(days):
+        days = days.copy()
+        days['balance'] += balance - stored_end
+        return days
+
+    rules = dictionaries.RegisterRules().data
+    months = zip_months(
+        register.TaskStatistics.open_storage()
+            .iter_months(date_from, date_to, chunksize),
+        register.HabitsStatistics.open_storage()
+            .iter_months(date_from, date_to, chunksize),
+    )
+    with TasksRep.open_storage().month_writer(date_from, date_to) \
+            as write_tasks, \
+            HabitsRep.open_storage().month_writer(date_from, date_to) \
+            as write_habits, \
+            DatesRep.open_storage().month_writer(
+                date_from, date_to, tail=shift_balance
+            ) as write_dates:
+        for key, (tasks, habits) in months:
+            tasks_rep = TasksRep.calc_chunk(
+                tasks if tasks is not None else register.TaskStatistics
+                    .template.astype(register.TaskStatistics.types_dict)
+            )
+            habits_rep = HabitsRep.calc_chunk(
+                habits if habits is not None else register.HabitsStatistics
+                    .template.astype(register.HabitsStatistics.types_dict),
+                rules
+            )
+            dates_rep = DatesRep.calc_chunk(tasks_rep, habits_rep, balance)
+            if len(dates_rep.index):
+                balance = int(dates_rep['balance'].iloc[-1])
+            write_tasks(key, tasks_rep)
+            write_habits(key, habits_rep)
+            write_dates(key, dates_rep)
+    return balance
+
 
 if __name__ == '__main__':
     a = HabitsRep()
@@ -0,0 +1,459 @@
+'''storage.py
+Хранилища для таблиц register. CsvStorage - прежний формат: один csv файл с
+разделителем ";" (снимок) и журнал рядом с ним. Замененные дни дописываются
+в журнал с fsync, чтение сводит снимок с журналом, а когда журнал
+разрастается, снимок переписывается (через временный файл и rename) и
+журнал удаляется. Записи журнала заменяют дни целиком, поэтому их повторное
+применение после сбоя ничего не портит.
+ParquetStorage хранит таблицу в parquet файлах по месяцам (нужен pyarrow):
+типы колонок сохраняются как есть, при чтении диапазона дат открываются
+только нужные месяцы, а при сохранении новых дней перезаписываются только их
+месяцы
+'''
+import os
+import json
+import logging
+import threading
+from contextlib import contextmanager
+import pandas as pd
+from config import JOURNAL_COMPACT_BYTES
+
+
+# блокировки по пути файла: дозапись в журнал, чтение и сжатие одной таблицы
+# не должны пересекаться
+_locks = {}
+
+
+def path_lock(path:str):
+    return _locks.setdefault(path, threading.RLock())
+
+
+def write_csv(data:pd.DataFrame, path:str):
+    '''Пишет csv во временный файл и подменяет им path, так что прерванная
+    запись не портит прежний файл'''
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8', newline='') as f:
+        data.to_csv(f, sep=';')
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class CsvStorage:
+    partitioned = False
+    # размер журнала, после которого снимок переписывается
+    compact_bytes = JOURNAL_COMPACT_BYTES
+
+    def __init__(
+        self,
+        path:str,
+        template:pd.DataFrame,
+        types:dict=None,
+        date_column='date'
+    ):
+        self.path = path
+        self.template = template
+        self.types = types
+        self.date_column = date_column
+        self._compactor = None
+
+    @property
+    def journal_path(self) -> str:
+        return self.path + '.journal'
+
+    @property
+    def lock(self):
+        return path_lock(self.path)
+
+    def typed(self, data) -> pd.DataFrame:
+        return data.astype(self.types) if self.types else data
+
+    def filter_dates(self, data, date_from=None, date_to=None):
+        if self.date_column is None:
+            return data
+        if date_from is not None:
+            data = data[data[self.date_column] >= pd.to_datetime(date_from)]
+        if date_to is not None:
+            data = data[data[self.date_column] <= pd.to_datetime(date_to)]
+        return data
+
+    def read_snapshot(self) -> pd.DataFrame:
+        if not os.path.exists(self.path):
+            self.template.to_csv(self.path, sep=';')
+            return self.typed(self.template.copy())
+        data = pd.read_csv(self.path, sep=';', index_col=0)
+        data = data.astype(self.template.dtypes.to_dict())
+        return self.typed(data)
+
+    def load(self, date_from=None, date_to=None) -> pd.DataFrame:
+        with self.lock:
+            data = self.read_snapshot()
+            records = self.read_journal()
+        data = self.apply_journal(data, records)
+        return self.filter_dates(data, date_from, date_to)
+
+    def journal_record(self, data:pd.DataFrame, dates) -> str:
+        # одна строка json: дни и все строки таблицы за эти дни
+        rows = data[self.template.columns].to_json(
+            orient='values', date_format='iso', date_unit='s'
+        )
+        dates = json.dumps([d.isoformat() for d in dates])
+        return f'{{"dates": {dates}, "rows": {rows}}}\n'
+
+    def read_journal(self) -> list:
+        '''Записи журнала по порядку: (даты, DataFrame строк за них).
+        Недописанная последняя строка (запись прервалась) пропускается'''
+        if not os.path.exists(self.journal_path):
+            return []
+        records = []
+        with open(self.journal_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.endswith('\n'):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    logging.warning(
+                        f'Поврежденная запись в журнале {self.journal_path}'
+                    )
+                    continue
+                rows = pd.DataFrame(
+                    record['rows'], columns=self.template.columns,
+                    dtype=object
+                )
+                records.append((
+                    [pd.Timestamp(d) for d in record['dates']],
+                    self.typed(rows.astype(self.template.dtypes.to_dict()))
+                ))
+        return records
+
+    def apply_journal(self, data:pd.DataFrame, records) -> pd.DataFrame:
+        # для каждого дня действует последняя запись, в которой он есть
+        if not records:
+            return data
+        latest = {}
+        for i, (dates, _) in enumerate(records):
+            for date in dates:
+                latest[date] = i
+        frames = [data[~data[self.date_column].isin(list(latest))]]
+        for i, (dates, rows) in enumerate(records):
+            own = [d for d in dates if latest[d] == i]
+            if own:
+                frames.append(rows[rows[self.date_column].isin(own)])
+        return self.sorted(pd.concat(frames, ignore_index=True))
+
+    def append_journal(self, record:str):
+        with self.lock, open(self.journal_path, 'ab') as f:
+            # хвост от прерванной записи отрезается, чтобы не склеить его
+            # со следующей записью
+            size = f.seek(0, os.SEEK_END)
+            if size and self._journal_tail() != b'\n':
+                f.truncate(self._last_newline() + 1)
+            f.write(record.encode('utf-8'))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _journal_tail(self) -> bytes:
+        with open(self.journal_path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1)
+
+    def _last_newline(self) -> int:
+        with open(self.journal_path, 'rb') as f:
+            return f.read().rfind(b'\n')
+
+    def journal_size(self) -> int:
+        try:
+            return os.path.getsize(self.journal_path)
+        except FileNotFoundError:
+            return 0
+
+    def drop_journal(self):
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+
+    def compact(self, background:bool=False):
+        '''Переписывает снимок с учетом журнала и удаляет журнал. С
+        background=True работает в отдельном потоке, процесс дождется его
+        перед выходом'''
+        if background:
+            if self._compactor is None or not self._compactor.is_alive():
+                self._compactor = threading.Thread(
+                    target=self.compact, name=f'compact {self.path}'
+                )
+                self._compactor.start()
+            return
+        with self.lock:
+            records = self.read_journal()
+            if not records:
+                return
+            data = self.apply_journal(self.read_snapshot(), records)
+            # сбой после замены снимка, но до удаления журнала безопасен:
+            # журнал применится к новому снимку еще раз с тем же результатом
+            write_csv(self.sorted(data), self.path)
+            self.drop_journal()
+        logging.info(f'Журнал {self.journal_path} перенесен в снимок')
+
+    def month_keys(self, data) -> pd.Series:
+        return data[self.date_column].dt.strftime('%Y-%m')
+
+    def iter_months(self, date_from=None, date_to=None, chunksize=50000):
+        '''Отдает таблицу по месяцам в порядке дат: (YYYY-MM, DataFrame).
+        Снимок читается кусками по chunksize строк, поэтому в памяти не
+        больше куска и одного месяца, дни из журнала подставляются в свои
+        месяцы'''
+        records = self.read_journal()
+        if not records:
+            yield from self.iter_snapshot_months(date_from, date_to, chunksize)
+            return
+        journal = self.filter_dates(
+            self.apply_journal(self.typed(self.template.copy()), records),
+            date_from, date_to
+        )
+        replaced = [d for dates, _ in records for d in dates]
+        extra = dict(tuple(journal.groupby(self.month_keys(journal))))
+        for key, part in self.iter_snapshot_months(
+            date_from, date_to, chunksize
+        ):
+            for earlier in sorted(k for k in extra if k < key):
+                yield earlier, extra.pop(earlier)
+            part = part[~part[self.date_column].isin(replaced)]
+            if key in extra:
+                part = self.sorted(pd.concat((part, extra.pop(key))))
+            if len(part.index):
+                yield key, part
+        for key in sorted(extra):
+            yield key, extra[key]
+
+    def iter_snapshot_months(self, date_from=None, date_to=None,
+                             chunksize=50000):
+        # файл снимка отсортирован по дате (см. save)
+        if not os.path.exists(self.path):
+            return
+        carry, last = None, None
+        for chunk in pd.read_csv(
+            self.path, sep=';', index_col=0, chunksize=chunksize
+        ):
+            chunk = self.typed(chunk.astype(self.template.dtypes.to_dict()))
+            if date_to is not None and len(chunk.index) and \
+                    chunk[self.date_column].iloc[0] > pd.to_datetime(date_to):
+                break
+            chunk = self.filter_dates(chunk, date_from, date_to)
+            if carry is not None:
+                chunk = pd.concat((carry, chunk))
+            if len(chunk.index) == 0:
+                continue
+            keys = self.month_keys(chunk)
+            # последний месяц куска может продолжиться в следующем куске
+            last = keys.iloc[-1]
+            complete = keys != last
+            for key, part in chunk[complete].groupby(keys[complete]):
+                yield key, part
+            carry = chunk[~complete]
+        if carry is not None and len(carry.index):
+            yield last, carry
+
+    @staticmethod
+    def day_before(date) -> pd.Timestamp:
+        return pd.Timestamp(date) - pd.Timedelta(days=1)
+
+    @staticmethod
+    def day_after(date) -> pd.Timestamp:
+        return pd.Timestamp(date) + pd.Timedelta(days=1)
+
+    @contextmanager
+    def month_writer(self, date_from=None, date_to=None, tail=None):
+        '''Пишет таблицу заново по месяцам: write(key, data) для каждого
+        месяца периода [date_from, date_to] по порядку. Строки до и после
+        периода остаются как были, строки после date_to можно поправить
+        функцией tail(data). Файл заменяется целиком после последнего
+        месяца'''
+        tmp_path = self.path + '.tmp'
+        rows = 0
+        with open(tmp_path, 'w', encoding='utf-8', newline='') as f:
+            def write(key, data):
+                nonlocal rows
+                data = self.typed(data).reset_index(drop=True)
+                data.index += rows
+                data.to_csv(f, sep=';', header=rows == 0)
+                rows += len(data.index)
+            if date_from is not None:
+                for key, part in self.iter_months(
+                    date_to=self.day_before(date_from)
+                ):
+                    write(key, part)
+            yield write
+            if date_to is not None:
+                for key, part in self.iter_months(
+                    date_from=self.day_after(date_to)
+                ):
+                    write(key, part if tail is None else tail(part))
+            if rows == 0:
+                self.template.to_csv(f, sep=';')
+            f.flush()
+            os.fsync(f.fileno())
+        with self.lock:
+            os.replace(tmp_path, self.path)
+            self.drop_journal()
+
+    def sorted(self, data) -> pd.DataFrame:
+        if self.date_column is not None:
+            data = data.sort_values(by=self.date_column, kind='stable')
+        return data.reset_index(drop=True)
+
+    def save(self, data:pd.DataFrame):
+        with self.lock:
+            write_csv(self.sorted(data), self.path)
+            self.drop_journal()
+
+    def replace_dates(self, data:pd.DataFrame, dates):
+        '''Заменяет в сохраненной таблице строки за dates строками из data:
+        дописывает их в журнал, снимок не переписывается'''
+        dates = sorted(set(pd.to_datetime(list(dates))))
+        if not dates:
+            return
+        data = self.typed(data)
+        data = data[data[self.date_column].isin(dates)]
+        self.append_journal(self.journal_record(data, dates))
+        if self.journal_size() > self.compact_bytes:
+            self.compact(background=True)
+
+
+class ParquetStorage(CsvStorage):
+    partitioned = True
+
+    def __init__(
+        self,
+        path:str,
+        template:pd.DataFrame,
+        types:dict=None,
+        date_column='date'
+    ):
+        super().__init__(path, template, types, date_column)
+        # data/tasks.csv -> data/tasks/2025-08.parquet
+        self.path = os.path.splitext(path)[0]
+        os.makedirs(self.path, exist_ok=True)
+
+    @staticmethod
+    def partition_key(date) -> str:
+        return pd.Timestamp(date).strftime('%Y-%m')
+
+    def partition_path(self, key:str) -> str:
+        return os.path.join(self.path, key + '.parquet')
+
+    def partitions(self) -> list:
+        return sorted(
+            f[:-len('.parquet')] for f in os.listdir(self.path)
+            if f.endswith('.parquet')
+        )
+
+    def empty(self) -> pd.DataFrame:
+        return self.typed(self.template.copy())
+
+    def read_partition(self, key:str, filters=None) -> pd.DataFrame:
+        path = self.partition_path(key)
+        if not os.path.exists(path):
+            return self.empty()
+        # pyarrow читает строки как StringDtype, а остальной код (и
+        # merge_asof по name) ждет тех же типов, что и у csv
+        return self.typed(pd.read_parquet(path, filters=filters))
+
+    def write_partition(self, key:str, data:pd.DataFrame):
+        path = self.partition_path(key)
+        if len(data.index) == 0:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        data = self.typed(data)
+        tmp_path = path + '.tmp'
+        self.sorted(data).to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path)
+
+    def load(self, date_from=None, date_to=None) -> pd.DataFrame:
+        if self.date_column is None:
+            return self.read_partition('all')
+        keys = self.partitions()
+        # месяцы вне диапазона даже не открываются, внутри месяца фильтр
+        # передается в pyarrow
+        filters = []
+        if date_from is not None:
+            keys = [k for k in keys if k >= self.partition_key(date_from)]
+            filters.append(
+                (self.date_column, '>=', pd.Timestamp(date_from)))
+        if date_to is not None:
+            keys = [k for k in keys if k <= self.partition_key(date_to)]
+            filters.append((self.date_column, '<=', pd.Timestamp(date_to)))
+        frames = [self.read_partition(k, filters or None) for k in keys]
+        if not frames:
+            return self.empty()
+        return pd.concat(frames, ignore_index=True)
+
+    def iter_months(self, date_from=None, date_to=None, chunksize=None):
+        # каждый месяц и так лежит в отдельном файле
+        for key in self.partitions():
+            if date_from is not None and key < self.partition_key(date_from):
+                continue
+            if date_to is not None and key > self.partition_key(date_to):
+                break
+            part = self.filter_dates(
+                self.read_partition(key), date_from, date_to
+            )
+            if len(part.index):
+                yield key, part
+
+    @contextmanager
+    def month_writer(self, date_from=None, date_to=None, tail=None):
+        # перезаписываются только месяцы периода, в крайних месяцах дни вне
+        # периода сохраняются
+        def write(key, data):
+            stored = self.read_partition(key)
+            outside = stored[~stored.index.isin(self.filter_dates(
+                stored, date_from, date_to
+            ).index)]
+            if len(outside.index):
+                data = pd.concat((outside, self.typed(data)),
+                                 ignore_index=True)
+            self.write_partition(key, data)
+        yield write
+        if date_to is None or tail is None:
+            return
+        after = self.day_after(date_to)
+        for key in self.partitions():
+            if key < self.partition_key(after):
+                continue
+            stored = self.read_partition(key)
+            later = stored[self.date_column] >= after
+            self.write_partition(key, pd.concat(
+                (stored[~later], tail(stored[later])), ignore_index=True
+            ))
+
+    def save(self, data:pd.DataFrame):
+        if self.date_column is None:
+            self.write_partition('all', data)
+            return
+        data = self.typed(data)
+        keys = self.month_keys(data)
+        written = set()
+        for key, part in data.groupby(keys):
+            self.write_partition(key, part)
+            written.add(key)
+        for key in set(self.partitions()) - written:
+            os.remove(self.partition_path(key))
+
+    def replace_dates(self, data:pd.DataFrame, dates):
+        dates = pd.to_datetime(list(dates))
+        data = self.typed(data)
+        data = data[data[self.date_column].isin(dates)]
+        for key in {self.partition_key(d) for d in dates}:
+            stored = self.read_partition(key)
+            stored = stored[~stored[self.date_column].isin(dates)]
+            part = data[self.month_keys(data) == key]
+            self.write_partition(
+                key, pd.concat((stored, part), ignore_index=True)
+            )
+
+
+backends = {
+    'csv': CsvStorage,
+    'parquet': ParquetStorage,
+}
@@ -0,0 +1,32 @@
+'''Быстрый разбор frontmatter должен давать то же, что yaml SafeLoader, или
+отдавать строку в yaml'''
+import pytest
+import yaml
+import obsidian as o
+
+VALUES = (
+    '12', '-3', '+7', '0', '012', '1_000', '1.5', '-1.5', '+1.5', '1.',
+    '.5', '-.5', '+.5', '1.5e+3', '.inf', 'true', 'False', 'yes', 'off',
+    'null', '~', '', '2025-01-01', '2025-01-01T07:30', '07:30', "'07:30'",
+    '"text"', 'text', 'два слова',
+)
+KEYS = ('habit', 'Привычка 1', 'true', 'yes', '1', '1.5', 'null', '~',
+        '2025-01-01')
+
+
+@pytest.mark.parametrize('value', VALUES)
+def test_values_as_safe_loader(value):
+    text = f'habit: {value}'
+    assert o.parse_frontmatter(text) == yaml.load(text, Loader=yaml.SafeLoader)
+
+
+@pytest.mark.parametrize('key', KEYS)
+def test_keys_as_safe_loader(key):
+    text = f'{key}: 1'
+    assert o.parse_frontmatter(text) == yaml.load(text, Loader=yaml.SafeLoader)
+
+
+@pytest.mark.parametrize('key', ('true', '1', 'null', '2025-01-01'))
+def test_non_string_key_is_not_flat(key):
+    with pytest.raises(o._NotFlat):
+        o._parse_flat_frontmatter(f'{key}: 1')
@@ -0,0 +1,16 @@
+'''Бюджет запуска консольной команды: main.py с разбором аргументов и
+модулями загрузки одной заметки не должен импортировать pandas, numpy, yaml
+и psycopg2 и должен укладываться в STARTUP_BUDGET_MS сверх запуска пустого
+интерпретатора'''
+import bench
+
+
+def test_no_heavy_modules_on_startup():
+    _, imported = bench.run_python(bench.STARTUP_CODE, *bench.HEAVY_MODULES)
+    assert [m for m in imported.split(',') if m] == []
+
+
+def test_startup_within_budget():
+    result = bench.check_startup()
+    assert result['overhead_ms'] <= result['budget_ms'], result
+    assert result['ok'], result
@@ -0,0 +1,153 @@
+'''watch.py
+Режим наблюдения: следит за папкой с заметками и загружает заметку, как
+только obsidian ее сохранил. Использует inotify (пакет inotify_simple), если
+он доступен, иначе опрашивает папку через os.scandir. Серия автосохранений
+одной заметки схлопывается в одну загрузку (debounce)
+'''
+import sys
+import time
+import logging
+from obsidian import DailyNote
+from manifest import VaultManifest, note_date
+from config import VAULT_PATH
+from metrics import metrics
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
+
+
+class VaultWatcher:
+    # сколько секунд заметка должна не меняться, чтобы ее загрузить
+    debounce = 2.0
+    # период опроса папки, если нет inotify
+    poll_interval = 1.0
+    # через сколько секунд повторить загрузку заметки, которая не загрузилась
+    retry_delay = 60.0
+
+    def __init__(self, writer, vault_path:str=VAULT_PATH, manifest=None,
+                 use_inotify:bool=True):
+        self.writer = writer
+        self.vault_path = vault_path
+        self.manifest = manifest or VaultManifest(vault_path)
+        self.pending = {}  # дата -> время последнего изменения
+        self.inotify = None
+        if use_inotify and INotify is not None:
+            self.inotify = INotify()
+            self.inotify.add_watch(
+                vault_path,
+                flags.CLOSE_WRITE | flags.MOVED_TO | flags.DELETE
+                | flags.MOVED_FROM
+            )
+            logging.info(f'Наблюдение за {vault_path} через inotify')
+        else:
+            logging.info(f'Наблюдение за {vault_path} опросом папки')
+
+    def collect(self, timeout:float):
+        # ждет изменений не дольше timeout и отмечает измененные даты
+        now = time.monotonic()
+        if self.inotify is not None:
+            for event in self.inotify.read(timeout=int(timeout * 1000)):
+                date = note_date(event.name)
+                if date is not None:
+                    self.pending[date] = time.monotonic()
+            return
+        time.sleep(timeout)
+        changes = self.manifest.refresh()
+        for date in changes.added + changes.modified + changes.deleted:
+            self.pending[date] = now
+
+    def ready(self) -> list:
+        # даты, которые не менялись дольше debounce
+        now = time.monotonic()
+        dates = [d for d, t in self.pending.items() if now - t >= self.debounce]
+        for date in dates:
+            del self.pending[date]
+        return sorted(dates)
+
+    def process(self, dates):
+        if self.inotify is not None:
+            self.manifest.refresh_dates(dates)
+        deleted = [d for d in dates if d not in self.manifest.entries]
+        for date in deleted:
+            logging.warning(
+                f'Заметка за {date.isoformat()} удалена, загруженные данные'
+                ' не изменены'
+            )
+        self.manifest.confirm(deleted)
+        # события inotify бывают и без изменения содержимого, а заметки,
+        # которые не загрузились раньше, загружаются снова
+        self.load(self.manifest.unconfirmed(dates))
+        if deleted:
+            self.manifest.save()
+
+    def load(self, dates):
+        written, failed = [], []
+        start = len(self.writer.failed_dates)
+        for date in dates:
+            try:
+                note = DailyNote(date)
+                note.parsed
+                self.writer.write(note)
+                written.append(date)
+            except Exception as ex:
+                logging.error(
+                    f'Заметку за {date.isoformat()} загрузить не удалось: {ex}'
+                )
+                failed.append(date)
+        if written:
+            try:
+                self.writer.commit()
+            except Exception as ex:
+                logging.error(f'Изменения заметок сохранить не удалось: {ex}')
+                failed += written
+        # writer пропускает заметки, которые не сохранились
+        failed += self.writer.failed_dates[start:]
+        loaded = [d for d in written if d not in failed]
+        # в манифест попадают только сохраненные заметки, остальные
+        # загрузятся снова через retry_delay или при следующем изменении
+        retry_at = time.monotonic() + self.retry_delay - self.debounce
+        for date in set(failed):
+            self.pending[date] = retry_at
+        if not loaded:
+            return
+        self.manifest.confirm(loaded)
+        self.manifest.save()
+        logging.info(
+            'Загружены изменения заметок: '
+            + ', '.join(d.isoformat() for d in loaded)
+        )
+
+    def step(self):
+        self.collect(self.poll_interval)
+        dates = self.ready()
+        if dates:
+            self.process(dates)
+
+    def run(self):
+        # заметки, измененные, пока наблюдение не работало. Если манифеста
+        # еще нет, текущее состояние просто запоминается
+        had_manifest = bool(self.manifest.entries)
+        changes = self.manifest.refresh()
+        if had_manifest:
+            self.process(changes.added + changes.modified + changes.deleted)
+        else:
+            self.manifest.confirm()
+            self.manifest.save()
+        try:
+            while True:
+                self.step()
+        except KeyboardInterrupt:
+            logging.info('Наблюдение остановлено')
+        finally:
+            self.writer.close()
+            if metrics.enabled:
+                print(metrics.report(), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    import backfill
+    from database import open_database
+    with open_database() as db:
+        VaultWatcher(backfill.DataBaseWriter(db, upsert=True)).run()